@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
-import json
+import hashlib
 import logging
 import os
+import random
 import sys
 import time
+import threading
 import ipaddress
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import Any, ClassVar, Dict, FrozenSet, List, Optional, Tuple, Union
+import orjson
 import requests
-from kubernetes import client, config, watch
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from kubernetes import client, config
 from kubernetes.client.rest import ApiException
 
 # Configure logging
@@ -19,6 +26,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Field manager recorded by server-side apply for the NetworkPolicies we own
+FIELD_MANAGER = 'egress-agent'
+
+# Generated NetworkPolicy identity and its constant, read-only parts
+GENERATED_POLICY_NAME = 'egress-policy-generated'
+_GENERATED_POLICY_LABELS = {'managed-by': 'egress-agent'}
+_SELECT_ALL_PODS: Dict[str, Any] = {}
+_EGRESS_POLICY_TYPES = ['Egress']
+
+# Server-side watch timeout; the watch is resumed from the last resourceVersion
+WATCH_TIMEOUT_SECONDS = 300
+
+
+def _backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Capped exponential backoff with jitter so reconnecting agents don't stampede"""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def policy_digest(policy_data: Dict[str, Any]) -> bytes:
+    """Stable digest of ConfigMap policy data, independent of key order"""
+    return hashlib.blake2b(orjson.dumps(policy_data, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+
+@lru_cache(maxsize=1024)
+def _parse_cidr(cidr: str) -> Union[ipaddress.IPv4Network, ipaddress.IPv6Network]:
+    """Parse a CIDR once; policies tend to reuse the same handful of blocks"""
+    return ipaddress.ip_network(cidr, strict=False)
+
+
+@lru_cache(maxsize=256, typed=True)
+def _tcp_port(port) -> Dict[str, Any]:
+    """Shared TCP port entry; generated NetworkPolicies are never mutated in place"""
+    return {'protocol': 'TCP', 'port': port}
+
 
 @dataclass
 class ValidationResult:
@@ -29,20 +70,22 @@ class ValidationResult:
 class PolicyValidator:
     """Validates egress policy configuration"""
     
-    VALID_AWS_SERVICES = {'s3', 'rds', 'ec2', 'dynamodb', 'lambda', 'ecs'}
-    VALID_ACTIONS = {'allow', 'deny'}
+    VALID_AWS_SERVICES: ClassVar[FrozenSet[str]] = frozenset(
+        map(sys.intern, ('s3', 'rds', 'ec2', 'dynamodb', 'lambda', 'ecs'))
+    )
+    VALID_ACTIONS: ClassVar[FrozenSet[str]] = frozenset(map(sys.intern, ('allow', 'deny')))
     
     def validate(self, policy: Dict[str, Any]) -> ValidationResult:
         """Validate policy structure and content"""
-        errors = []
+        errors: List[str] = []
         
         # Check default action
-        default_action = policy.get('defaultAction', 'deny')
-        if default_action not in self.VALID_ACTIONS:
+        default_action: Any = policy.get('defaultAction', 'deny')
+        if not isinstance(default_action, str) or default_action not in self.VALID_ACTIONS:
             errors.append(f"Invalid defaultAction: {default_action}")
         
         # Validate destinations
-        destinations = policy.get('allowedDestinations', [])
+        destinations: Any = policy.get('allowedDestinations', [])
         if not isinstance(destinations, list):
             errors.append("allowedDestinations must be a list")
             return ValidationResult(False, errors)
@@ -52,17 +95,22 @@ class PolicyValidator:
         
         return ValidationResult(len(errors) == 0, errors)
     
-    def _validate_destination(self, dest: Dict[str, Any], index: int, errors: List[str]):
+    def _validate_destination(self, dest: Dict[str, Any], index: int, errors: List[str]) -> None:
         """Validate individual destination"""
         if not dest.get('name'):
             errors.append(f"Destination {index}: missing 'name' field")
         
-        if not dest.get('ports'):
+        ports: Any = dest.get('ports')
+        if not ports:
             errors.append(f"Destination {index}: missing 'ports' field")
+        elif not isinstance(ports, list) or not all(
+            type(port) is int and 1 <= port <= 65535 for port in ports
+        ):
+            errors.append(f"Destination {index}: ports must be integers between 1 and 65535")
         
         # Must have either cidr or awsService
-        has_cidr = 'cidr' in dest
-        has_aws_service = 'awsService' in dest
+        has_cidr: bool = 'cidr' in dest
+        has_aws_service: bool = 'awsService' in dest
         
         if not (has_cidr or has_aws_service):
             errors.append(f"Destination {index}: must specify either 'cidr' or 'awsService'")
@@ -73,60 +121,215 @@ class PolicyValidator:
         # Validate CIDR format
         if has_cidr:
             try:
-                ipaddress.ip_network(dest['cidr'], strict=False)
-            except ValueError:
+                _parse_cidr(dest['cidr'])
+            except (ValueError, TypeError):
                 errors.append(f"Destination {index}: Invalid CIDR format: {dest['cidr']}")
         
         # Validate AWS service
         if has_aws_service:
-            service = dest['awsService'].lower()
+            service: str = dest['awsService'].lower()
             if service not in self.VALID_AWS_SERVICES:
                 errors.append(f"Destination {index}: Invalid AWS service: {service}")
             
-            if not dest.get('regions'):
+            regions: Any = dest.get('regions')
+            if not regions:
                 errors.append(f"Destination {index}: AWS service requires 'regions' field")
+            elif not isinstance(regions, list) or not all(isinstance(region, str) for region in regions):
+                errors.append(f"Destination {index}: regions must be a list of strings")
 
 
 class AWSServiceResolver:
     """Resolves AWS service names to CIDR blocks"""
     
-    def __init__(self):
-        self._cache = {}
+    IP_RANGES_URL = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+    
+    def __init__(self, cache_file: Optional[str] = None, session: Optional[requests.Session] = None):
+        self._cache: Dict[Tuple[str, FrozenSet[str]], List[str]] = {}
         self._cache_ttl = 3600  # 1 hour
         self._last_fetch = 0
+        # Callers may pass a shared session so other HTTPS traffic reuses its pool
+        self._session = session or self._create_session()
+        self._cache_file = cache_file or os.getenv(
+            'AWS_IP_RANGES_CACHE', '/tmp/egress-agent/ip-ranges.json'
+        )
+        
+        # Conditional GET validators and the service -> region -> [prefix] index
+        self._etag = None
+        self._last_modified = None
+        self._index: Dict[str, Dict[str, List[str]]] = {}
+        # Bumped on every index swap so callers can tell their results are stale
+        self.index_generation = 0
+        self._stop_refresh = threading.Event()
+        
+        # At most one download in flight; concurrent callers wait on the same future
+        self._refresh_lock = threading.Lock()
+        self._refresh_future: Optional[Future] = None
+        self._refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='aws-ip-ranges')
+        self._load_cached_ranges()
+    
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """Keep-alive session with a small pool; the ranges endpoint is a single host"""
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
+        ))
+        return session
     
     def resolve_service_cidrs(self, service: str, regions: List[str]) -> List[str]:
         """Resolve AWS service to CIDR blocks for specified regions"""
-        cache_key = f"{service}:{','.join(sorted(regions))}"
+        if (time.time() - self._last_fetch) >= self._cache_ttl:
+            try:
+                self._refresh_once()
+            except Exception as e:
+                logger.error(f"Failed to resolve AWS service CIDRs: {e}")
+                if not self._index:
+                    return []
+        
+        # _set_index swaps the index before the cache, so reading the cache first
+        # guarantees the index is at least as new; a result computed from it is
+        # only ever stored in the cache read alongside it
+        cache = self._cache
+        index = self._index
         
         # Check cache
-        if cache_key in self._cache and (time.time() - self._last_fetch) < self._cache_ttl:
-            return self._cache[cache_key]
+        cache_key = (service, frozenset(regions))
+        if cache_key in cache:
+            return cache[cache_key]
         
-        # Fetch AWS IP ranges
-        try:
-            response = requests.get('https://ip-ranges.amazonaws.com/ip-ranges.json', timeout=10)
-            response.raise_for_status()
-            ip_ranges = response.json()
-            
-            cidrs = []
-            service_upper = service.upper()
-            
-            for prefix in ip_ranges.get('prefixes', []):
-                if (prefix.get('service') == service_upper and 
-                    prefix.get('region') in regions):
-                    cidrs.append(prefix['ip_prefix'])
+        by_region = index.get(service.upper(), {})
+        cidrs = [p for r in dict.fromkeys(regions) for p in by_region.get(r, ())]
+        cache[cache_key] = cidrs
+        
+        logger.info(f"Resolved {service} in {regions} to {len(cidrs)} CIDR blocks")
+        return cidrs
+    
+    def start_background_refresh(self, retry_interval: int = 60) -> threading.Thread:
+        """Keep the ranges index warm so event processing never waits on a download"""
+        def refresh_loop():
+            while True:
+                try:
+                    self._refresh_once(force=True)
+                    delay = self._cache_ttl
+                except Exception as e:
+                    logger.warning(f"Background AWS IP ranges refresh failed: {e}")
+                    delay = retry_interval
+                
+                if self._stop_refresh.wait(delay):
+                    return
+        
+        thread = threading.Thread(target=refresh_loop, name='aws-ip-ranges-refresh', daemon=True)
+        thread.start()
+        return thread
+    
+    def stop_background_refresh(self):
+        """Stop the background refresh thread"""
+        self._stop_refresh.set()
+    
+    def _refresh_once(self, force: bool = False):
+        """Refresh the ranges, or wait for the refresh another caller already started"""
+        with self._refresh_lock:
+            if not force and (time.time() - self._last_fetch) < self._cache_ttl:
+                return
             
-            # Cache result
-            self._cache[cache_key] = cidrs
+            future = self._refresh_future
+            if future is None:
+                future = self._refresh_executor.submit(self._refresh_and_clear)
+                self._refresh_future = future
+        
+        future.result()
+    
+    def _refresh_and_clear(self):
+        """Run a refresh and mark it finished so the next miss can start another"""
+        try:
+            self._refresh()
+        finally:
+            with self._refresh_lock:
+                self._refresh_future = None
+    
+    def _refresh(self):
+        """Revalidate the AWS IP ranges, downloading them only when they changed"""
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+        
+        response = self._session.get(self.IP_RANGES_URL, headers=headers, timeout=10)
+        if response.status_code == 304:
+            logger.debug("AWS IP ranges not modified, reusing index")
             self._last_fetch = time.time()
-            
-            logger.info(f"Resolved {service} in {regions} to {len(cidrs)} CIDR blocks")
-            return cidrs
-            
-        except Exception as e:
-            logger.error(f"Failed to resolve AWS service CIDRs: {e}")
-            return []
+            return
+        
+        response.raise_for_status()
+        
+        # Parse the body bytes directly (no intermediate str) and keep only the
+        # compact index; the parsed document is dropped as soon as it is indexed
+        ip_ranges = orjson.loads(response.content)
+        sync_token = ip_ranges.get('syncToken')
+        create_date = ip_ranges.get('createDate')
+        self._set_index(self._build_index(ip_ranges.get('prefixes', [])))
+        del ip_ranges
+        
+        self._etag = response.headers.get('ETag')
+        self._last_modified = response.headers.get('Last-Modified')
+        self._last_fetch = time.time()
+        self._save_cached_ranges(sync_token, create_date)
+    
+    @staticmethod
+    def _build_index(prefixes: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[str]]]:
+        """Group prefixes by service and region in a single pass"""
+        index: Dict[str, Dict[str, List[str]]] = {}
+        for prefix in prefixes:
+            by_region = index.setdefault(prefix.get('service'), {})
+            by_region.setdefault(prefix.get('region'), []).append(prefix['ip_prefix'])
+        return index
+    
+    def _set_index(self, index: Dict[str, Dict[str, List[str]]]):
+        """Swap in a new index and drop results resolved from the old one"""
+        self._index = index
+        self._cache = {}
+        self.index_generation += 1
+    
+    def _load_cached_ranges(self):
+        """Load the last downloaded ranges so a restart only needs a conditional GET"""
+        try:
+            with open(self._cache_file, 'rb') as f:
+                cached = orjson.loads(f.read())
+            index = cached['index']
+            if not isinstance(index, dict):
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        
+        self._set_index(index)
+        self._etag = cached.get('etag')
+        self._last_modified = cached.get('last_modified')
+        logger.info(
+            f"Loaded AWS IP ranges {cached.get('syncToken')} ({cached.get('createDate')}) "
+            f"from {self._cache_file}"
+        )
+    
+    def _save_cached_ranges(self, sync_token: Optional[str], create_date: Optional[str]):
+        """Persist the index keyed by the document's syncToken/createDate"""
+        cached = {
+            'syncToken': sync_token,
+            'createDate': create_date,
+            'etag': self._etag,
+            'last_modified': self._last_modified,
+            'index': self._index
+        }
+        
+        try:
+            os.makedirs(os.path.dirname(self._cache_file) or '.', exist_ok=True)
+            tmp_file = f"{self._cache_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(cached))
+            os.replace(tmp_file, self._cache_file)
+        except OSError as e:
+            logger.warning(f"Failed to persist AWS IP ranges to {self._cache_file}: {e}")
 
 
 class EgressAgent:
@@ -152,13 +355,31 @@ class EgressAgent:
         
         self.core_v1 = client.CoreV1Api(self.k8s_client)
         self.networking_v1 = client.NetworkingV1Api(self.k8s_client)
+        
+        # Last resourceVersion seen on the watch, used to resume without a re-list
+        self._resource_version: Optional[str] = None
+        
+        # Digest of the last successfully applied data per (namespace, name), with
+        # the AWS ranges index generation its awsService CIDRs were resolved from
+        self._policy_hashes: Dict[Tuple[str, str], Tuple[bytes, int]] = {}
+        
+        # Index generation the current watch session replays ConfigMaps against
+        self._watch_generation = self.aws_resolver.index_generation
+        
+        # Single-threaded workers sharded by namespace: events for one namespace
+        # stay ordered while different namespaces hit the API server concurrently
+        apply_workers = max(1, int(os.getenv('APPLY_WORKERS', '4')))
+        self._workers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'egress-apply-{i}')
+            for i in range(apply_workers)
+        ]
     
     def generate_network_policy(self, namespace: str, policy_data: Dict[str, str]) -> Dict[str, Any]:
         """Generate NetworkPolicy from ConfigMap data"""
         try:
             policy_json = policy_data.get('policy.json', '{}')
-            policy = json.loads(policy_json)
-        except json.JSONDecodeError as e:
+            policy = orjson.loads(policy_json)
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in policy: {e}")
         
         # Validate policy
@@ -166,35 +387,32 @@ class EgressAgent:
         if not validation.is_valid:
             raise ValueError(f"Invalid policy: {validation.errors}")
         
-        # Generate NetworkPolicy
-        network_policy = {
+        # Process destinations
+        egress = []
+        for dest in policy.get('allowedDestinations', []):
+            egress_rule = self._create_egress_rule(dest)
+            if egress_rule:
+                egress.append(egress_rule)
+        
+        # Only the namespace and egress rules vary; the rest comes from shared constants
+        return {
             'apiVersion': 'networking.k8s.io/v1',
             'kind': 'NetworkPolicy',
             'metadata': {
-                'name': 'egress-policy-generated',
+                'name': GENERATED_POLICY_NAME,
                 'namespace': namespace,
-                'labels': {
-                    'managed-by': 'egress-agent'
-                }
+                'labels': _GENERATED_POLICY_LABELS
             },
             'spec': {
-                'podSelector': {},
-                'policyTypes': ['Egress'],
-                'egress': []
+                'podSelector': _SELECT_ALL_PODS,
+                'policyTypes': _EGRESS_POLICY_TYPES,
+                'egress': egress
             }
         }
-        
-        # Process destinations
-        for dest in policy.get('allowedDestinations', []):
-            egress_rule = self._create_egress_rule(dest)
-            if egress_rule:
-                network_policy['spec']['egress'].append(egress_rule)
-        
-        return network_policy
     
     def _create_egress_rule(self, destination: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create egress rule from destination config"""
-        ports = [{'protocol': 'TCP', 'port': port} for port in destination.get('ports', [])]
+        ports = [_tcp_port(port) for port in destination.get('ports', [])]
         
         if 'cidr' in destination:
             return {
@@ -211,113 +429,200 @@ class EgressAgent:
                 logger.warning(f"No CIDRs found for {service} in {regions}")
                 return None
             
-            # Create rule for first CIDR (NetworkPolicy limitation)
-            # TODO: Create multiple rules for multiple CIDRs
+            # A single rule may list many peers, so every CIDR goes into one 'to' list
             return {
-                'to': [{'ipBlock': {'cidr': cidrs[0]}}],
+                'to': [{'ipBlock': {'cidr': cidr}} for cidr in cidrs],
                 'ports': ports
             }
         
         return None
     
-    def apply_network_policy(self, network_policy: Dict[str, Any]):
-        """Apply NetworkPolicy to cluster"""
+    def apply_network_policy(self, network_policy: Dict[str, Any]) -> bool:
+        """Apply NetworkPolicy to cluster, returning whether it succeeded"""
         namespace = network_policy['metadata']['namespace']
         name = network_policy['metadata']['name']
         
         if self.dry_run:
             logger.info(f"DRY RUN: Would apply NetworkPolicy {name} in {namespace}")
-            return
+            return True
         
         try:
-            # Try to get existing policy
-            try:
-                existing = self.networking_v1.read_namespaced_network_policy(
-                    name=name, namespace=namespace
-                )
-                # Update existing
-                self.networking_v1.patch_namespaced_network_policy(
-                    name=name,
-                    namespace=namespace,
-                    body=network_policy
-                )
-                logger.info(f"Updated NetworkPolicy {name} in {namespace}")
-            
-            except ApiException as e:
-                if e.status == 404:
-                    # Create new
-                    self.networking_v1.create_namespaced_network_policy(
-                        namespace=namespace,
-                        body=network_policy
-                    )
-                    logger.info(f"Created NetworkPolicy {name} in {namespace}")
-                else:
-                    raise
+            # Server-side apply creates or updates the policy in a single PATCH,
+            # so no read is needed beforehand
+            response = self.networking_v1.api_client.call_api(
+                '/apis/networking.k8s.io/v1/namespaces/{namespace}/networkpolicies/{name}', 'PATCH',
+                path_params={'namespace': namespace, 'name': name},
+                query_params=[('fieldManager', FIELD_MANAGER), ('force', 'true')],
+                header_params={
+                    'Accept': 'application/json',
+                    'Content-Type': 'application/apply-patch+yaml'
+                },
+                body=network_policy,
+                auth_settings=['BearerToken'],
+                _return_http_data_only=True,
+                # Only the status matters; skip building a V1NetworkPolicy from the reply
+                _preload_content=False
+            )
+            # Read off the short reply so the pooled connection is reusable
+            response.drain_conn()
+            response.release_conn()
+            logger.info(f"Applied NetworkPolicy {name} in {namespace}")
+            return True
         
         except ApiException as e:
             logger.error(f"Failed to apply NetworkPolicy: {e}")
+            return False
     
     def process_configmap_event(self, event_type: str, configmap: Dict[str, Any]):
         """Process ConfigMap watch event"""
-        metadata = configmap.get('metadata', {})
-        name = metadata.get('name')
-        namespace = metadata.get('namespace')
-        labels = metadata.get('labels', {})
-        
-        # Only process managed ConfigMaps
-        if labels.get('egress-controller') != 'managed':
-            return
+        # The watch's label selector already limits events to managed ConfigMaps
+        metadata = configmap['metadata']
+        name = metadata['name']
+        namespace = metadata['namespace']
         
         logger.info(f"Processing {event_type} event for ConfigMap {name} in {namespace}")
+        key = (namespace, name)
         
         if event_type in ['ADDED', 'MODIFIED']:
             try:
                 policy_data = configmap.get('data', {})
+                
+                # Label/annotation-only updates and re-lists leave the data untouched;
+                # a new ranges index still forces a rebuild of the resolved CIDRs
+                digest = (policy_digest(policy_data), self.aws_resolver.index_generation)
+                if self._policy_hashes.get(key) == digest:
+                    logger.debug(f"ConfigMap {name} in {namespace} unchanged, skipping")
+                    return
+                
                 network_policy = self.generate_network_policy(namespace, policy_data)
-                self.apply_network_policy(network_policy)
+                if self.apply_network_policy(network_policy):
+                    self._policy_hashes[key] = digest
             
             except Exception as e:
                 logger.error(f"Failed to process ConfigMap {name}: {e}")
         
         elif event_type == 'DELETED':
+            self._policy_hashes.pop(key, None)
+            
             # Clean up NetworkPolicy
             try:
                 if not self.dry_run:
-                    self.networking_v1.delete_namespaced_network_policy(
-                        name='egress-policy-generated',
-                        namespace=namespace
+                    response = self.networking_v1.delete_namespaced_network_policy(
+                        name=GENERATED_POLICY_NAME,
+                        namespace=namespace,
+                        _preload_content=False
                     )
+                    response.drain_conn()
+                    response.release_conn()
                     logger.info(f"Deleted NetworkPolicy in {namespace}")
             except ApiException as e:
                 if e.status != 404:
                     logger.error(f"Failed to delete NetworkPolicy: {e}")
     
+    def dispatch_configmap_event(self, event_type: str, configmap: Dict[str, Any]) -> Future:
+        """Queue a ConfigMap event on the worker that owns its namespace"""
+        namespace = configmap['metadata']['namespace']
+        worker = self._workers[hash(namespace) % len(self._workers)]
+        future = worker.submit(self.process_configmap_event, event_type, configmap)
+        future.add_done_callback(self._log_event_failure)
+        return future
+    
+    @staticmethod
+    def _log_event_failure(future: Future):
+        """Log errors from queued events, which nothing else reads back"""
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to process ConfigMap event: {error}", exc_info=error)
+    
+    @staticmethod
+    def _iter_watch_events(response, chunk_size: int = 64 * 1024):
+        """Decode newline-delimited watch events straight from the raw HTTP stream"""
+        buffer = b''
+        for chunk in response.stream(amt=chunk_size, decode_content=True):
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield orjson.loads(line)
+        
+        if buffer.strip():
+            yield orjson.loads(buffer)
+    
     def start_watching(self):
-        """Start watching ConfigMaps"""
+        """Run one ConfigMap watch session, resuming from the last seen resourceVersion"""
         logger.info("Starting ConfigMap watch...")
         
-        w = watch.Watch()
         watch_namespace = os.getenv('WATCH_NAMESPACE', '')
         
+        # Raw watch response: events are parsed with orjson instead of being
+        # deserialized into client model objects
+        kwargs = {
+            'label_selector': 'egress-controller=managed',
+            'watch': True,
+            'allow_watch_bookmarks': True,
+            'timeout_seconds': WATCH_TIMEOUT_SECONDS,
+            '_preload_content': False
+        }
+        # After an AWS ranges update, re-list so every ConfigMap is replayed as
+        # ADDED and its NetworkPolicy rebuilt from the new index
+        generation = self.aws_resolver.index_generation
+        if generation != self._watch_generation:
+            logger.info("AWS IP ranges changed, re-listing ConfigMaps")
+            self._resource_version = None
+            self._watch_generation = generation
+        
+        if self._resource_version:
+            kwargs['resource_version'] = self._resource_version
+        
+        if watch_namespace:
+            response = self.core_v1.list_namespaced_config_map(watch_namespace, **kwargs)
+        else:
+            response = self.core_v1.list_config_map_for_all_namespaces(**kwargs)
+        
         try:
-            if watch_namespace:
-                stream = w.stream(
-                    self.core_v1.list_namespaced_config_map,
-                    namespace=watch_namespace,
-                    label_selector='egress-controller=managed'
-                )
-            else:
-                stream = w.stream(
-                    self.core_v1.list_config_map_for_all_namespaces,
-                    label_selector='egress-controller=managed'
-                )
-            
-            for event in stream:
-                self.process_configmap_event(event['type'], event['object'])
+            for event in self._iter_watch_events(response):
+                event_type = event['type']
+                obj = event['object']
+                
+                if event_type == 'ERROR':
+                    # 410 Gone: the resourceVersion is too old, re-list from scratch
+                    if obj.get('code') == 410:
+                        self._resource_version = None
+                        logger.warning(f"Watch error: {obj.get('message')}")
+                        break
+                    
+                    # Anything else counts as a failed session so run() backs off
+                    raise ApiException(status=obj.get('code'), reason=obj.get('message'))
+                
+                self._resource_version = obj['metadata'].get('resourceVersion', self._resource_version)
+                if event_type == 'BOOKMARK':
+                    continue
+                
+                self.dispatch_configmap_event(event_type, obj)
+        finally:
+            # The session can end mid-stream; close first so a connection with
+            # unread chunks is never handed back to the pool, as Watch.stream does
+            response.close()
+            response.release_conn()
+    
+    def run(self):
+        """Watch ConfigMaps until interrupted, reconnecting with capped exponential backoff"""
+        failures = 0
         
-        except Exception as e:
-            logger.error(f"Watch failed: {e}")
-            time.sleep(5)  # Wait before restart
+        while True:
+            try:
+                self.start_watching()
+                failures = 0
+            
+            except Exception as e:
+                if isinstance(e, ApiException) and e.status == 410:
+                    # resourceVersion expired before we reconnected, re-list from scratch
+                    self._resource_version = None
+                
+                failures += 1
+                delay = _backoff_delay(failures)
+                logger.error(f"Watch failed: {e}; reconnecting in {delay:.1f}s")
+                time.sleep(delay)
 
 
 def main():
@@ -325,16 +630,12 @@ def main():
     logger.info("Starting EKS Egress Control Agent")
     
     agent = EgressAgent()
+    agent.aws_resolver.start_background_refresh()
     
-    while True:
-        try:
-            agent.start_watching()
-        except KeyboardInterrupt:
-            logger.info("Shutting down...")
-            break
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            time.sleep(10)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,31 @@
+# Gunicorn settings for the egress policy webhook
+import multiprocessing
+import os
+
+bind = f"{os.getenv('WEBHOOK_HOST', '0.0.0.0')}:{os.getenv('WEBHOOK_PORT', '8443')}"
+
+# Validation is CPU-bound Python, so scale with processes rather than threads
+workers = int(os.getenv('WEBHOOK_WORKERS', multiprocessing.cpu_count()))
+
+# Threads per worker keep slow TLS clients and bursts from blocking a whole process
+worker_class = 'gthread'
+threads = int(os.getenv('WEBHOOK_THREADS', 8))
+
+# Worker heartbeat files need a writable dir; the root filesystem is read-only
+# in the cluster, and /dev/shm also keeps the heartbeat off disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Load the app once in the master and fork it into the workers
+preload_app = True
+
+# TLS in production, plain HTTP in development
+_cert_file = os.getenv('TLS_CERT_FILE', '/etc/certs/tls.crt')
+_key_file = os.getenv('TLS_KEY_FILE', '/etc/certs/tls.key')
+if os.path.exists(_cert_file) and os.path.exists(_key_file):
+    certfile = _cert_file
+    keyfile = _key_file
+
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'INFO').lower()
@@ -1,16 +1,54 @@
 #!/usr/bin/env python3
 
-import json
+import argparse
+import ipaddress
 import logging
-import subprocess
+import shlex
+import sys
+import threading
 import time
-from kubernetes import client, config
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
+from kubernetes.stream import stream
+from urllib3.util.retry import Retry
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Optional, Tuple
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Long-lived pod each namespace's probes exec into, kept between validation runs
+PROBE_POD_NAME = "egress-probe"
+PROBE_LABEL_SELECTOR = "egress-probe=true"
+
+# Destinations no egress policy allows, probed in every namespace
+BLOCKED_TARGETS: Tuple[Tuple[str, int], ...] = (
+    ("8.8.8.8", 53),      # Google DNS
+    ("1.1.1.1", 53),      # Cloudflare DNS
+    ("httpbin.org", 80),  # External HTTP service
+)
+
+# Known endpoints used to probe AWS service destinations
+AWS_SERVICE_ENDPOINTS: Mapping[str, str] = MappingProxyType({
+    sys.intern(service): endpoint for service, endpoint in (
+        ('s3', 's3.amazonaws.com'),
+        ('dynamodb', 'dynamodb.us-east-1.amazonaws.com'),
+        ('rds', 'rds.amazonaws.com')
+    )
+})
+
+
+@lru_cache(maxsize=256)
+def _probe_address(cidr: str) -> str:
+    """First usable host of a CIDR, computed without enumerating hosts()"""
+    network = ipaddress.ip_network(cidr, strict=False)
+    return str(network.network_address + 1) if network.num_addresses > 2 else str(network.network_address)
+
 
 @dataclass
 class TestResult:
@@ -31,35 +69,82 @@ class EgressPolicyTester:
         except:
             config.load_kube_config()
         
-        self.core_v1 = client.CoreV1Api()
-        self.networking_v1 = client.NetworkingV1Api()
+        # One pooled client for all REST calls, sized for the validation thread pools
+        self._api_config = client.Configuration.get_default_copy()
+        self._api_config.connection_pool_maxsize = 64
+        self._api_config.retries = Retry(total=3, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+        api_client = client.ApiClient(self._api_config)
+        
+        self.core_v1 = client.CoreV1Api(api_client)
+        self.networking_v1 = client.NetworkingV1Api(api_client)
+        
+        # API reads rarely change within a run, so reuse them for a short window
+        self._cache_ttl = 30  # seconds
+        self._namespaces: Optional[List[str]] = None
+        self._namespaces_fetched = 0.0
+        self._networkpolicy_cache: Dict[str, Tuple[float, bool]] = {}
+        
+        # policy.json per namespace, filled from the ConfigMap list in get_managed_namespaces
+        self._policy_cache: Dict[str, str] = {}
+        
+        # stream() temporarily swaps the request method of the ApiClient it runs on,
+        # so each thread execs through its own client, reused across its probes
+        self._thread_local = threading.local()
+        
+        # Side lookups overlapped with a namespace's probes; kept apart from the
+        # namespace pool so those threads never wait on their own pool
+        self._lookup_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="egress-lookup")
+    
+    @property
+    def _exec_api(self) -> client.CoreV1Api:
+        """Per-thread CoreV1Api used only for exec streams"""
+        exec_api = getattr(self._thread_local, "exec_api", None)
+        if exec_api is None:
+            exec_api = client.CoreV1Api(client.ApiClient(self._api_config))
+            self._thread_local.exec_api = exec_api
+        return exec_api
     
     def get_managed_namespaces(self) -> List[str]:
         """Get namespaces with egress policies"""
+        if self._namespaces is not None and (time.time() - self._namespaces_fetched) < self._cache_ttl:
+            return list(self._namespaces)
+        
         namespaces = []
         
-        # Find ConfigMaps with egress-controller label
-        configmaps = self.core_v1.list_config_map_for_all_namespaces(
-            label_selector="egress-controller=managed"
+        # Find ConfigMaps with egress-controller label, skipping model deserialization
+        response = self.core_v1.list_config_map_for_all_namespaces(
+            label_selector="egress-controller=managed",
+            _preload_content=False
         )
+        configmaps = orjson.loads(response.data)
         
-        for cm in configmaps.items:
-            ns = cm.metadata.namespace
+        # The list already carries the policies, so keep them for get_policy_rules
+        policy_cache = {}
+        for cm in configmaps.get('items') or []:
+            metadata = cm['metadata']
+            ns = metadata['namespace']
             if ns not in namespaces:
                 namespaces.append(ns)
+            if metadata['name'] == "egress-policy":
+                policy_cache[ns] = (cm.get('data') or {}).get('policy.json', '{}')
         
-        return namespaces
+        self._policy_cache = policy_cache
+        self._namespaces = namespaces
+        self._namespaces_fetched = time.time()
+        return list(namespaces)
     
     def get_policy_rules(self, namespace: str) -> Dict[str, Any]:
         """Extract policy rules from ConfigMap"""
         try:
-            cm = self.core_v1.read_namespaced_config_map(
-                name="egress-policy", 
-                namespace=namespace
-            )
+            policy_json = self._policy_cache.get(namespace)
+            if policy_json is None:
+                cm = self.core_v1.read_namespaced_config_map(
+                    name="egress-policy", 
+                    namespace=namespace
+                )
+                policy_json = cm.data.get('policy.json', '{}')
             
-            policy_json = cm.data.get('policy.json', '{}')
-            return json.loads(policy_json)
+            return orjson.loads(policy_json)
         
         except Exception as e:
             logger.error(f"Failed to get policy for {namespace}: {e}")
@@ -67,156 +152,237 @@ class EgressPolicyTester:
     
     def check_networkpolicy_exists(self, namespace: str) -> bool:
         """Check if NetworkPolicy was generated"""
+        cached = self._networkpolicy_cache.get(namespace)
+        if cached is not None and (time.time() - cached[0]) < self._cache_ttl:
+            return cached[1]
+        
         try:
             self.networking_v1.read_namespaced_network_policy(
                 name="egress-policy-generated",
-                namespace=namespace
-            )
-            return True
-        except:
+                namespace=namespace,
+                _preload_content=False
+            ).release_conn()
+            exists = True
+        except ApiException as e:
+            # Only a definite answer is cached; other errors are retried next call
+            if e.status != 404:
+                return False
+            exists = False
+        except Exception:
             return False
+        
+        self._networkpolicy_cache[namespace] = (time.time(), exists)
+        return exists
+    
+    def invalidate(self):
+        """Drop cached namespace, policy and NetworkPolicy lookups"""
+        self._namespaces = None
+        self._policy_cache = {}
+        self._networkpolicy_cache = {}
     
-    def create_test_pod(self, namespace: str, name: str = "egress-test-pod") -> str:
-        """Create test pod for connectivity testing"""
+    def ensure_probe_pod(self, namespace: str) -> str:
+        """Return the long-lived probe pod for a namespace, creating it if missing"""
+        pods = self.core_v1.list_namespaced_pod(
+            namespace=namespace,
+            label_selector=PROBE_LABEL_SELECTOR
+        )
+        for pod in pods.items:
+            if pod.metadata.deletion_timestamp is None:
+                if pod.status.phase != "Running":
+                    self._wait_for_pod_running(namespace, pod.metadata.name)
+                return pod.metadata.name
+        
         pod_spec = {
             "apiVersion": "v1",
             "kind": "Pod",
             "metadata": {
-                "name": name,
+                "name": PROBE_POD_NAME,
                 "namespace": namespace,
-                "labels": {"test": "egress-validation"}
+                "labels": {"test": "egress-validation", "egress-probe": "true"}
             },
             "spec": {
                 "containers": [{
                     "name": "test",
                     "image": "curlimages/curl:latest",
-                    "command": ["sleep", "3600"],
+                    "command": ["sleep", "infinity"],
                     "resources": {
                         "requests": {"memory": "32Mi", "cpu": "10m"},
                         "limits": {"memory": "64Mi", "cpu": "50m"}
                     }
                 }],
-                "restartPolicy": "Never"
+                "restartPolicy": "Always"
             }
         }
         
         try:
-            self.core_v1.create_namespaced_pod(namespace=namespace, body=pod_spec)
-            
-            # Wait for pod to be ready
-            for _ in range(30):
-                pod = self.core_v1.read_namespaced_pod(name=name, namespace=namespace)
-                if pod.status.phase == "Running":
-                    return name
-                time.sleep(2)
+            try:
+                self.core_v1.create_namespaced_pod(namespace=namespace, body=pod_spec)
+            except ApiException as e:
+                if e.status != 409:
+                    raise
             
-            raise Exception("Pod not ready after 60s")
+            self._wait_for_pod_running(namespace, PROBE_POD_NAME)
+            return PROBE_POD_NAME
         
         except Exception as e:
-            logger.error(f"Failed to create test pod in {namespace}: {e}")
+            logger.error(f"Failed to create probe pod in {namespace}: {e}")
             raise
     
+    def _wait_for_pod_running(self, namespace: str, name: str):
+        """Block until a pod is Running, woken by the API server instead of polling"""
+        deadline = time.monotonic() + 60
+        w = watch.Watch()
+        for event in w.stream(
+            self.core_v1.list_namespaced_pod,
+            namespace=namespace,
+            field_selector=f"metadata.name={name}",
+            timeout_seconds=60
+        ):
+            if self._pod_ready(name, event['object'].status.phase):
+                w.stop()
+                return
+        
+        # The watch can close before its timeout; poll the rest of the window,
+        # starting fast and backing off so a slow pod does not hammer the API
+        read_pod = self.core_v1.read_namespaced_pod
+        delay = 0.1
+        while time.monotonic() < deadline:
+            if self._pod_ready(name, read_pod(name=name, namespace=namespace).status.phase):
+                return
+            time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+            delay = min(delay * 1.6, 2.0)
+        
+        raise Exception("Pod not ready after 60s")
+    
+    @staticmethod
+    def _pod_ready(name: str, phase: Optional[str]) -> bool:
+        """True once Running; raises if the pod already ran to completion"""
+        if phase in ("Succeeded", "Failed"):
+            raise Exception(f"Pod {name} finished with phase {phase} before becoming ready")
+        return phase == "Running"
+    
+    def cleanup_probe_pods(self):
+        """Delete the probe pods from all managed namespaces"""
+        for namespace in self.get_managed_namespaces():
+            try:
+                self.core_v1.delete_collection_namespaced_pod(
+                    namespace=namespace,
+                    label_selector=PROBE_LABEL_SELECTOR
+                )
+                logger.info(f"🧹 Removed probe pods in {namespace}")
+            except Exception as e:
+                logger.error(f"Failed to remove probe pods in {namespace}: {e}")
+    
     def test_connectivity(self, namespace: str, pod_name: str, target: str, port: int, timeout: int = 5) -> TestResult:
         """Test connectivity from pod to target"""
-        test_name = f"connect-to-{target}:{port}"
-        
-        try:
-            # Use kubectl exec to test connectivity
-            cmd = [
-                "kubectl", "exec", "-n", namespace, pod_name, "--",
-                "timeout", str(timeout), "curl", "-s", "--connect-timeout", str(timeout),
-                f"http://{target}:{port}"
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout+5)
-            
-            if result.returncode == 0:
-                return TestResult(namespace, test_name, "unknown", "allow", True, "Connection successful")
-            elif result.returncode == 28:  # Timeout
-                return TestResult(namespace, test_name, "unknown", "deny", True, "Connection blocked (timeout)")
-            else:
-                return TestResult(namespace, test_name, "unknown", "deny", True, f"Connection failed: {result.stderr}")
-        
-        except Exception as e:
-            return TestResult(namespace, test_name, "unknown", "error", False, str(e))
+        return self.run_probes(namespace, pod_name, [(target, port, timeout)])[0]
     
-    def test_allowed_destinations(self, namespace: str, policy: Dict[str, Any]) -> List[TestResult]:
-        """Test that allowed destinations are reachable"""
-        results = []
+    def run_probes(self, namespace: str, pod_name: str, probes: List[Tuple[str, int, int]]) -> List[TestResult]:
+        """Run (target, port, timeout) connectivity probes through a single exec"""
+        if not probes:
+            return []
+        
+        # Every probe is a background job reporting "RC <index> <exit code>", so one
+        # stream setup covers the batch and the slowest timeout bounds its duration.
+        # Only exit codes matter, so stderr is never opened and curl output is discarded
+        script = "".join(
+            f"(timeout {int(timeout)} curl -s -o /dev/null --connect-timeout {int(timeout)} "
+            f"{shlex.quote(f'http://{target}:{int(port)}')}; echo \"RC {i} $?\") &\n"
+            for i, (target, port, timeout) in enumerate(probes)
+        ) + "wait\n"
         
         try:
-            pod_name = self.create_test_pod(namespace)
-            
-            for dest in policy.get('allowedDestinations', []):
-                if 'cidr' in dest:
-                    # Test CIDR destination (use first IP in range)
-                    import ipaddress
-                    network = ipaddress.ip_network(dest['cidr'], strict=False)
-                    target_ip = str(list(network.hosts())[0]) if network.num_addresses > 2 else str(network.network_address)
-                    
-                    for port in dest.get('ports', [80]):
-                        result = self.test_connectivity(namespace, pod_name, target_ip, port)
-                        result.expected = "allow"
-                        result.success = (result.actual == "allow")
-                        results.append(result)
-                
-                elif 'awsService' in dest:
-                    # Test AWS service (use known endpoints)
-                    service_endpoints = {
-                        's3': 's3.amazonaws.com',
-                        'dynamodb': 'dynamodb.us-east-1.amazonaws.com',
-                        'rds': 'rds.amazonaws.com'
-                    }
-                    
-                    endpoint = service_endpoints.get(dest['awsService'])
-                    if endpoint:
-                        for port in dest.get('ports', [443]):
-                            result = self.test_connectivity(namespace, pod_name, endpoint, port)
-                            result.expected = "allow"
-                            result.success = (result.actual == "allow")
-                            results.append(result)
-        
+            # Exec in-process over the API client instead of forking kubectl
+            resp = stream(
+                self._exec_api.connect_get_namespaced_pod_exec,
+                pod_name, namespace,
+                command=["sh", "-c", script], stderr=False, stdin=False, stdout=True, tty=False,
+                _preload_content=False
+            )
+            try:
+                resp.run_forever(timeout=max(timeout for _, _, timeout in probes) + 5)
+                exec_error = "Exec timed out" if resp.is_open() else None
+                stdout = resp.read_stdout()
+            finally:
+                resp.close()
         except Exception as e:
-            logger.error(f"Failed to test allowed destinations in {namespace}: {e}")
+            # API errors can carry the whole response body; keep the report readable
+            exec_error, stdout = str(e)[:256], ""
         
-        finally:
-            # Cleanup test pod
-            try:
-                self.core_v1.delete_namespaced_pod(name=pod_name, namespace=namespace)
-            except:
-                pass
+        returncodes: Dict[int, int] = {}
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == "RC":
+                returncodes[int(fields[1])] = int(fields[2])
         
-        return results
-    
-    def test_blocked_destinations(self, namespace: str) -> List[TestResult]:
-        """Test that blocked destinations are not reachable"""
         results = []
-        blocked_targets = [
-            ("8.8.8.8", 53),      # Google DNS
-            ("1.1.1.1", 53),      # Cloudflare DNS
-            ("httpbin.org", 80),  # External HTTP service
-        ]
+        add_result = results.append
+        get_returncode = returncodes.get
+        for i, (target, port, _) in enumerate(probes):
+            test_name = f"connect-to-{target}:{port}"
+            returncode = get_returncode(i)
+            if returncode is None:
+                add_result(TestResult(namespace, test_name, "unknown", "error", False,
+                                      exec_error or "No result from probe"))
+            elif returncode == 0:
+                add_result(TestResult(namespace, test_name, "unknown", "allow", True, "Connection successful"))
+            elif returncode in (28, 124):  # curl / timeout(1) timeout
+                add_result(TestResult(namespace, test_name, "unknown", "deny", True, "Connection blocked (timeout)"))
+            else:
+                add_result(TestResult(namespace, test_name, "unknown", "deny", True,
+                                      f"Connection failed: curl exit code {returncode}"))
         
-        try:
-            pod_name = self.create_test_pod(namespace, "egress-block-test")
+        return results
+    
+    def allowed_probes(self, policy: Dict[str, Any]) -> List[Tuple[str, int]]:
+        """Targets that the policy's allowed destinations should reach"""
+        probes = []
+        for dest in policy.get('allowedDestinations', []):
+            if 'cidr' in dest:
+                # Test CIDR destination (use first IP in range)
+                target_ip = _probe_address(dest['cidr'])
+                
+                probes.extend((target_ip, port) for port in dest.get('ports', [80]))
             
-            for target, port in blocked_targets:
-                result = self.test_connectivity(namespace, pod_name, target, port, timeout=3)
-                result.expected = "deny"
-                result.success = (result.actual == "deny")
-                results.append(result)
+            elif 'awsService' in dest:
+                # Test AWS service (use known endpoints)
+                service = dest['awsService']
+                endpoint = AWS_SERVICE_ENDPOINTS.get(sys.intern(service)) if isinstance(service, str) else None
+                if endpoint:
+                    probes.extend((endpoint, port) for port in dest.get('ports', [443]))
+        
+        return probes
+    
+    def test_destinations(self, namespace: str, policy: Dict[str, Any]) -> List[TestResult]:
+        """Test that allowed destinations are reachable and blocked ones are not"""
+        # A policy the probes cannot be built from is a failure of its own; the
+        # blocked targets are still probed so the namespace never looks clean
+        policy_errors = []
+        try:
+            allowed = self.allowed_probes(policy)
+        except Exception as e:
+            logger.error(f"Failed to read allowed destinations in {namespace}: {e}")
+            allowed = []
+            policy_errors.append(TestResult(
+                namespace, "allowed-destinations", "valid", "invalid", False,
+                f"Could not build probes from policy: {e}"
+            ))
         
+        probes = [(target, port, 5) for target, port in allowed]
+        probes += [(target, port, 3) for target, port in BLOCKED_TARGETS]
+        
+        try:
+            pod_name = self.ensure_probe_pod(namespace)
+            results = self.run_probes(namespace, pod_name, probes)
         except Exception as e:
-            logger.error(f"Failed to test blocked destinations in {namespace}: {e}")
+            logger.error(f"Failed to test destinations in {namespace}: {e}")
+            return policy_errors
         
-        finally:
-            # Cleanup test pod
-            try:
-                self.core_v1.delete_namespaced_pod(name=pod_name, namespace=namespace)
-            except:
-                pass
+        for i, result in enumerate(results):
+            result.expected = "allow" if i < len(allowed) else "deny"
+            result.success = (result.actual == result.expected)
         
-        return results
+        return policy_errors + results
     
     def validate_namespace(self, namespace: str) -> Dict[str, Any]:
         """Validate egress policies for a namespace"""
@@ -241,8 +407,13 @@ class EgressPolicyTester:
             ))
             return validation
         
-        # Check if NetworkPolicy was generated
-        validation["networkpolicy_exists"] = self.check_networkpolicy_exists(namespace)
+        # Check if NetworkPolicy was generated, overlapped with probe pod readiness and probes
+        networkpolicy_check = self._lookup_pool.submit(self.check_networkpolicy_exists, namespace)
+        
+        # Test allowed and blocked destinations in one batch
+        destination_tests = self.test_destinations(namespace, policy)
+        
+        validation["networkpolicy_exists"] = networkpolicy_check.result()
         
         if not validation["networkpolicy_exists"]:
             validation["tests"].append(TestResult(
@@ -250,18 +421,12 @@ class EgressPolicyTester:
                 "NetworkPolicy not generated from ConfigMap"
             ))
         
-        # Test allowed destinations
-        allowed_tests = self.test_allowed_destinations(namespace, policy)
-        validation["tests"].extend(allowed_tests)
-        
-        # Test blocked destinations
-        blocked_tests = self.test_blocked_destinations(namespace)
-        validation["tests"].extend(blocked_tests)
+        validation["tests"].extend(destination_tests)
         
         # Calculate summary
-        validation["summary"]["total"] = len(validation["tests"])
-        validation["summary"]["passed"] = sum(1 for t in validation["tests"] if t.success)
-        validation["summary"]["failed"] = validation["summary"]["total"] - validation["summary"]["passed"]
+        total = len(validation["tests"])
+        passed = sum(t.success for t in validation["tests"])
+        validation["summary"] = {"total": total, "passed": passed, "failed": total - passed}
         
         return validation
     
@@ -279,14 +444,20 @@ class EgressPolicyTester:
             "overall_summary": {"total": 0, "passed": 0, "failed": 0}
         }
         
-        for namespace in namespaces:
-            validation = self.validate_namespace(namespace)
-            results["namespaces"].append(validation)
+        # Namespaces are validated independently and mostly wait on the API server
+        with ThreadPoolExecutor(max_workers=min(16, len(namespaces))) as executor:
+            validations = list(executor.map(self.validate_namespace, namespaces))
+        
+        overall = Counter(results["overall_summary"])
+        add_namespace = results["namespaces"].append
+        update_overall = overall.update
+        for validation in validations:
+            add_namespace(validation)
             
             # Update overall summary
-            results["overall_summary"]["total"] += validation["summary"]["total"]
-            results["overall_summary"]["passed"] += validation["summary"]["passed"]
-            results["overall_summary"]["failed"] += validation["summary"]["failed"]
+            update_overall(validation["summary"])
+        
+        results["overall_summary"] = dict(overall)
         
         return results
     
@@ -299,6 +470,7 @@ class EgressPolicyTester:
         for ns_result in results["namespaces"]:
             namespace = ns_result["namespace"]
             summary = ns_result["summary"]
+            tests = ns_result["tests"]
             
             print(f"\n📋 Namespace: {namespace}")
             print(f"   Policy ConfigMap: {'✅' if ns_result['policy_exists'] else '❌'}")
@@ -306,7 +478,7 @@ class EgressPolicyTester:
             print(f"   Tests: {summary['passed']}/{summary['total']} passed")
             
             # Show failed tests
-            failed_tests = [t for t in ns_result["tests"] if not t.success]
+            failed_tests = [t for t in tests if not t.success]
             if failed_tests:
                 print("   ❌ Failed tests:")
                 for test in failed_tests:
@@ -332,7 +504,16 @@ class EgressPolicyTester:
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Validate egress NetworkPolicy enforcement")
+    parser.add_argument("--cleanup", action="store_true",
+                        help="delete the probe pods from all managed namespaces and exit")
+    args = parser.parse_args()
+    
     tester = EgressPolicyTester()
+    if args.cleanup:
+        tester.cleanup_probe_pods()
+        return
+    
     results = tester.run_full_validation()
     tester.print_results(results)
 
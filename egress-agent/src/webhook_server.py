@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
-import json
+import hashlib
 import logging
 import os
 import base64
-from flask import Flask, request, jsonify
-from egress_agent import PolicyValidator
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Any, Optional, Tuple, Union
+import orjson
+from flask import Flask, Response, jsonify
+from flask.json.provider import JSONProvider
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from egress_agent import PolicyValidator, ValidationResult
 
 # Configure logging
 logging.basicConfig(
@@ -14,9 +21,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return orjson.loads(s)
+    
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        # Hand the bytes straight to the response instead of round-tripping through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json'
+        )
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 validator = PolicyValidator()
 
+# LRU of blake2b digests of policy.json documents that last validated cleanly
+SEEN_VALID_MAX = 1024
+_seen_valid: "OrderedDict[bytes, None]" = OrderedDict()
+_seen_valid_lock = threading.Lock()
+
 
 def create_admission_response(allowed: bool, message: str = "", uid: str = ""):
     """Create Kubernetes admission response"""
@@ -34,22 +65,100 @@ def create_admission_response(allowed: bool, message: str = "", uid: str = ""):
     }
 
 
-@app.route('/validate', methods=['POST'])
-def validate_configmap():
-    """Validate egress policy ConfigMaps"""
+# create_admission_response pre-serialized around its uid and message, so a review
+# is encoded by escaping two strings instead of building and dumping a dict
+_RESPONSE_HEAD = b'{"apiVersion":"admission.k8s.io/v1","kind":"AdmissionReview","response":{"uid":'
+_RESPONSE_ALLOWED = b',"allowed":true,"status":{"code":200,"message":'
+_RESPONSE_DENIED = b',"allowed":false,"status":{"code":400,"message":'
+_RESPONSE_TAIL = b'}}}'
+
+
+def encode_admission_response(allowed: bool, message: str = "", uid: str = "") -> bytes:
+    """Serialized equivalent of create_admission_response"""
+    return b''.join((
+        _RESPONSE_HEAD, orjson.dumps(uid),
+        _RESPONSE_ALLOWED if allowed else _RESPONSE_DENIED, orjson.dumps(message),
+        _RESPONSE_TAIL
+    ))
+
+
+def admission_shape_error(admission_review: Any) -> Optional[str]:
+    """Structural check of an AdmissionReview, run before any field access"""
+    if not isinstance(admission_review, dict):
+        return "AdmissionReview must be a JSON object"
+    req = admission_review.get('request', {})
+    if not isinstance(req, dict):
+        return "request must be an object"
+    configmap = req.get('object', {})
+    if not isinstance(configmap, dict):
+        return "request.object must be an object"
+    metadata = configmap.get('metadata', {})
+    if not isinstance(metadata, dict) or not isinstance(metadata.get('labels', {}), dict):
+        return "request.object.metadata and its labels must be objects"
+    data = configmap.get('data', {})
+    if not isinstance(data, dict) or not isinstance(data.get('policy.json', ''), str):
+        return "request.object.data must be an object of strings"
+    return None
+
+
+def policy_shape_error(policy: Any) -> Optional[str]:
+    """Structural check of a parsed policy.json, run before the validator reads it"""
+    if not isinstance(policy, dict):
+        return "policy.json must be a JSON object"
+    destinations = policy.get('allowedDestinations', [])
+    if isinstance(destinations, list):
+        for i, dest in enumerate(destinations):
+            if not isinstance(dest, dict):
+                return f"Destination {i}: must be an object"
+            if not isinstance(dest.get('awsService', ''), str):
+                return f"Destination {i}: awsService must be a string"
+    return None
+
+
+def validate_policy_json(policy_json: str) -> ValidationResult:
+    """Parse and validate policy.json, short-circuiting documents already seen valid"""
+    digest = hashlib.blake2b(policy_json.encode(), digest_size=16).digest()
+    with _seen_valid_lock:
+        if digest in _seen_valid:
+            _seen_valid.move_to_end(digest)
+            return ValidationResult(True, [])
+    
+    policy = orjson.loads(policy_json)
+    shape_error = policy_shape_error(policy)
+    if shape_error:
+        return ValidationResult(False, [shape_error])
+    
+    result = validator.validate(policy)
+    
+    # Only valid documents are remembered, so rejected spam cannot evict real policies
+    if result.is_valid:
+        with _seen_valid_lock:
+            _seen_valid[digest] = None
+            if len(_seen_valid) > SEEN_VALID_MAX:
+                _seen_valid.popitem(last=False)
+    return result
+
+
+def validate_configmap(body: bytes) -> Tuple[bytes, int]:
+    """Validate egress policy ConfigMaps, returning the encoded review and HTTP status"""
     uid = ""  # Initialize uid early
     
     try:
         # Handle JSON parsing errors gracefully
         try:
-            admission_review = request.get_json(force=True)
+            admission_review = orjson.loads(body)
         except Exception as json_error:
             logger.error(f"Failed to parse JSON request: {json_error}")
-            return jsonify(create_admission_response(False, "Invalid JSON request", uid)), 400
+            return encode_admission_response(False, "Invalid JSON request", uid), 400
         
         if not admission_review:
             logger.error("No admission review data received")
-            return jsonify(create_admission_response(False, "No data received", uid)), 400
+            return encode_admission_response(False, "No data received", uid), 400
+        
+        shape_error = admission_shape_error(admission_review)
+        if shape_error:
+            logger.error(f"Malformed admission review: {shape_error}")
+            return encode_admission_response(False, f"Malformed AdmissionReview: {shape_error}", uid), 400
         
         # Extract request details
         req = admission_review.get('request', {})
@@ -63,53 +172,85 @@ def validate_configmap():
         labels = configmap.get('metadata', {}).get('labels', {})
         if labels.get('egress-controller') != 'managed':
             logger.debug("ConfigMap not managed by egress-controller, allowing")
-            return jsonify(create_admission_response(True, "Not an egress policy ConfigMap", uid))
+            return encode_admission_response(True, "Not an egress policy ConfigMap", uid), 200
         
         # Validate policy data
         data = configmap.get('data', {})
         policy_json = data.get('policy.json', '')
         
         if not policy_json.strip():
-            return jsonify(create_admission_response(
+            return encode_admission_response(
                 False, "Missing policy.json in ConfigMap data", uid
-            )), 400
+            ), 400
         
-        # Parse and validate JSON
+        # Parse and validate JSON; re-applies of the same policy hit the cache
         try:
-            policy = json.loads(policy_json)
-        except json.JSONDecodeError as e:
-            return jsonify(create_admission_response(
+            validation_result = validate_policy_json(policy_json)
+        except orjson.JSONDecodeError as e:
+            return encode_admission_response(
                 False, f"Invalid JSON in policy.json: {str(e)}", uid
-            )), 400
-        
-        # Validate policy structure
-        validation_result = validator.validate(policy)
+            ), 400
         
         if validation_result.is_valid:
             logger.info(f"Policy validation successful for ConfigMap {configmap.get('metadata', {}).get('name')}")
-            return jsonify(create_admission_response(True, "Policy validation successful", uid))
+            return encode_admission_response(True, "Policy validation successful", uid), 200
         else:
             error_msg = f"Policy validation failed: {'; '.join(validation_result.errors)}"
             logger.warning(error_msg)
-            return jsonify(create_admission_response(False, error_msg, uid)), 400
+            return encode_admission_response(False, error_msg, uid), 400
     
     except Exception as e:
         logger.error(f"Webhook validation error: {str(e)}")
-        return jsonify(create_admission_response(
+        return encode_admission_response(
             False, f"Internal validation error: {str(e)}", uid
-        )), 500
+        ), 500
+
+
+# Precomputed WSGI status lines for the codes validate_configmap returns
+STATUS_LINES = {code: f"{code} {HTTPStatus(code).phrase}" for code in (200, 400, 404, 405, 500)}
+
+
+def validate_wsgi(environ, start_response):
+    """Bare WSGI handler for /validate, bypassing Flask's per-request machinery"""
+    # The mount is a prefix; like the Flask route, only /validate itself matches
+    if environ.get('PATH_INFO'):
+        start_response(STATUS_LINES[404], [('Content-Type', 'application/json')])
+        return [encode_admission_response(False, "Not found")]
+    
+    if environ.get('REQUEST_METHOD') != 'POST':
+        start_response(STATUS_LINES[405], [('Allow', 'POST'), ('Content-Type', 'application/json')])
+        return [encode_admission_response(False, "Method not allowed")]
+    
+    length = environ.get('CONTENT_LENGTH')
+    if length:
+        body = environ['wsgi.input'].read(int(length))
+    elif environ.get('wsgi.input_terminated'):
+        body = environ['wsgi.input'].read()
+    else:
+        body = b''
+    
+    response, status = validate_configmap(body)
+    start_response(STATUS_LINES[status], [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(response)))
+    ])
+    return [response]
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "egress-policy-webhook"}), 200
+    return jsonify({"status": "healthy", "service": "egress-policy-webhook"})
 
 
 @app.route('/ready', methods=['GET'])
 def readiness_check():
     """Readiness check endpoint"""
-    return jsonify({"status": "ready", "service": "egress-policy-webhook"}), 200
+    return jsonify({"status": "ready", "service": "egress-policy-webhook"})
+
+
+# Admission reviews go straight to the bare handler; Flask keeps the probe endpoints
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/validate': validate_wsgi})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the modules under src importable from every test file
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -3,19 +3,24 @@
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 import json
-import sys
 import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from kubernetes.client.rest import ApiException
 
 from egress_agent import EgressAgent, PolicyValidator, AWSServiceResolver
 
 
 class TestPolicyValidator(unittest.TestCase):
     
-    def setUp(self):
-        self.validator = PolicyValidator()
+    @classmethod
+    def setUpClass(cls):
+        # PolicyValidator is stateless, so one instance serves every test
+        cls.validator = PolicyValidator()
     
     def test_valid_policy_with_cidr(self):
         """Test valid policy with CIDR destination"""
@@ -93,18 +98,60 @@ class TestPolicyValidator(unittest.TestCase):
         }
         result = self.validator.validate(policy)
         self.assertFalse(result.is_valid)
+    
+    def test_invalid_ports(self):
+        """Test ports outside 1-65535 or not integers"""
+        for ports in ([0], [443, 65536], ["443"], [True], 443):
+            policy = {
+                "allowedDestinations": [
+                    {
+                        "name": "bad-ports",
+                        "cidr": "10.1.0.0/16",
+                        "ports": ports
+                    }
+                ]
+            }
+            result = self.validator.validate(policy)
+            self.assertFalse(result.is_valid, ports)
+            self.assertIn("ports must be integers", str(result.errors))
+    
+    def test_regions_must_be_list(self):
+        """Test a bare region string is rejected rather than matched per character"""
+        policy = {
+            "allowedDestinations": [
+                {
+                    "name": "s3-access",
+                    "awsService": "s3",
+                    "regions": "us-east-1",
+                    "ports": [443]
+                }
+            ]
+        }
+        result = self.validator.validate(policy)
+        self.assertFalse(result.is_valid)
+        self.assertIn("regions must be a list", str(result.errors))
 
 
 class TestAWSServiceResolver(unittest.TestCase):
     
     def setUp(self):
-        self.resolver = AWSServiceResolver()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'ip-ranges.json')
+        self.resolver = AWSServiceResolver(cache_file=self.cache_file)
     
-    @patch('requests.get')
-    def test_resolve_s3_cidrs(self, mock_get):
-        """Test S3 CIDR resolution"""
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def _mock_response(self, ip_ranges=None, status_code=200, headers=None):
         mock_response = Mock()
-        mock_response.json.return_value = {
+        mock_response.status_code = status_code
+        mock_response.headers = headers or {}
+        mock_response.content = json.dumps(ip_ranges).encode()
+        return mock_response
+    
+    def test_resolve_s3_cidrs(self):
+        """Test S3 CIDR resolution"""
+        ip_ranges = {
             "prefixes": [
                 {
                     "ip_prefix": "52.216.0.0/15",
@@ -118,20 +165,36 @@ class TestAWSServiceResolver(unittest.TestCase):
                 }
             ]
         }
-        mock_get.return_value = mock_response
         
-        cidrs = self.resolver.resolve_service_cidrs("s3", ["us-east-1"])
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(ip_ranges)
+            cidrs = self.resolver.resolve_service_cidrs("s3", ["us-east-1"])
         
         self.assertEqual(len(cidrs), 2)
         self.assertIn("52.216.0.0/15", cidrs)
         self.assertIn("54.231.0.0/17", cidrs)
     
+    def test_resolve_filters_service_and_region(self):
+        """Test only prefixes for the requested service and regions are returned"""
+        ip_ranges = {
+            "prefixes": [
+                {"ip_prefix": "52.216.0.0/15", "region": "us-east-1", "service": "S3"},
+                {"ip_prefix": "3.5.0.0/19", "region": "eu-west-1", "service": "S3"},
+                {"ip_prefix": "18.34.0.0/19", "region": "us-west-2", "service": "S3"},
+                {"ip_prefix": "3.0.0.0/15", "region": "us-east-1", "service": "EC2"}
+            ]
+        }
+        
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(ip_ranges)
+            cidrs = self.resolver.resolve_service_cidrs("s3", ["us-east-1", "eu-west-1"])
+        
+        self.assertEqual(sorted(cidrs), ["3.5.0.0/19", "52.216.0.0/15"])
+    
     def test_cache_functionality(self):
         """Test CIDR caching works"""
-        with patch('requests.get') as mock_get:
-            mock_response = Mock()
-            mock_response.json.return_value = {"prefixes": []}
-            mock_get.return_value = mock_response
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response({"prefixes": []})
             
             # First call
             self.resolver.resolve_service_cidrs("s3", ["us-east-1"])
@@ -140,13 +203,138 @@ class TestAWSServiceResolver(unittest.TestCase):
             
             # Should only make one HTTP request
             self.assertEqual(mock_get.call_count, 1)
+    
+    def test_concurrent_misses_share_one_download(self):
+        """Test concurrent cache misses wait on a single in-flight refresh"""
+        release = threading.Event()
+        response = self._mock_response({
+            "prefixes": [
+                {"ip_prefix": "52.216.0.0/15", "region": "us-east-1", "service": "S3"}
+            ]
+        })
+        
+        def slow_get(*args, **kwargs):
+            release.wait(timeout=5)
+            return response
+        
+        with patch.object(self.resolver._session, 'get', side_effect=slow_get) as mock_get:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [
+                    executor.submit(self.resolver.resolve_service_cidrs, "s3", ["us-east-1"])
+                    for _ in range(4)
+                ]
+                time.sleep(0.1)
+                release.set()
+                results = [future.result(timeout=5) for future in futures]
+            
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(results, [["52.216.0.0/15"]] * 4)
+    
+    def test_not_modified_reuses_index(self):
+        """Test a 304 response keeps the previously downloaded ranges"""
+        ip_ranges = {
+            "syncToken": "1700000000",
+            "prefixes": [
+                {"ip_prefix": "52.94.0.0/22", "region": "us-east-1", "service": "DYNAMODB"}
+            ]
+        }
+        
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(ip_ranges, headers={'ETag': '"abc"'})
+            self.resolver.resolve_service_cidrs("dynamodb", ["us-east-1"])
+            
+            # Expire the cache and answer the revalidation with 304
+            self.resolver._last_fetch = 0
+            mock_get.return_value = self._mock_response(status_code=304)
+            cidrs = self.resolver.resolve_service_cidrs("dynamodb", ["us-east-1"])
+            
+            self.assertEqual(cidrs, ["52.94.0.0/22"])
+            self.assertEqual(mock_get.call_args[1]['headers']['If-None-Match'], '"abc"')
+    
+    def test_index_swap_during_lookup_is_not_cached(self):
+        """Test a lookup racing an index swap never caches the old result"""
+        resolver = self.resolver
+        resolver._last_fetch = time.time()
+        new_index = {'S3': {'us-east-1': ['3.5.0.0/19']}}
+        
+        class SwappingIndex(dict):
+            def get(self, *args):
+                # The background refresh lands between the cache check and the lookup
+                resolver._set_index(new_index)
+                return dict.get(self, *args)
+        
+        resolver._set_index(SwappingIndex({'S3': {'us-east-1': ['52.216.0.0/15']}}))
+        resolver.resolve_service_cidrs("s3", ["us-east-1"])
+        
+        self.assertEqual(resolver.resolve_service_cidrs("s3", ["us-east-1"]), ['3.5.0.0/19'])
+    
+    def test_background_refresh_warms_index(self):
+        """Test the background refresh serves resolves without another download"""
+        ip_ranges = {
+            "prefixes": [
+                {"ip_prefix": "52.216.0.0/15", "region": "us-east-1", "service": "S3"}
+            ]
+        }
+        
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(ip_ranges)
+            thread = self.resolver.start_background_refresh()
+            self.resolver.stop_background_refresh()
+            thread.join(timeout=5)
+            
+            cidrs = self.resolver.resolve_service_cidrs("s3", ["us-east-1"])
+            
+            self.assertEqual(cidrs, ["52.216.0.0/15"])
+            self.assertEqual(mock_get.call_count, 1)
+    
+    def test_shared_session(self):
+        """Test an injected session is used for the ranges fetch"""
+        session = Mock()
+        session.get.return_value = self._mock_response({"prefixes": []})
+        resolver = AWSServiceResolver(cache_file=self.cache_file, session=session)
+        
+        resolver.resolve_service_cidrs("s3", ["us-east-1"])
+        
+        session.get.assert_called_once()
+    
+    def test_ranges_persisted_to_disk(self):
+        """Test a fresh resolver revalidates the ranges saved by a previous one"""
+        ip_ranges = {
+            "syncToken": "1700000000",
+            "createDate": "2023-11-14-22-13-20",
+            "prefixes": [
+                {"ip_prefix": "52.216.0.0/15", "region": "us-east-1", "service": "S3"}
+            ]
+        }
+        
+        with patch.object(self.resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(ip_ranges, headers={'ETag': '"abc"'})
+            self.resolver.resolve_service_cidrs("s3", ["us-east-1"])
+        
+        resolver = AWSServiceResolver(cache_file=self.cache_file)
+        with patch.object(resolver._session, 'get') as mock_get:
+            mock_get.return_value = self._mock_response(status_code=304)
+            cidrs = resolver.resolve_service_cidrs("s3", ["us-east-1"])
+            
+            self.assertEqual(cidrs, ["52.216.0.0/15"])
+            self.assertEqual(mock_get.call_args[1]['headers']['If-None-Match'], '"abc"')
 
 
 class TestEgressAgent(unittest.TestCase):
     
     def setUp(self):
         self.mock_k8s_client = Mock()
-        self.agent = EgressAgent(k8s_client=self.mock_k8s_client)
+        # Keep the ranges cache out of the host's /tmp/egress-agent
+        self.tmpdir = tempfile.mkdtemp()
+        cache_file = os.path.join(self.tmpdir, 'ip-ranges.json')
+        with patch.dict(os.environ, {'AWS_IP_RANGES_CACHE': cache_file}):
+            self.agent = EgressAgent(k8s_client=self.mock_k8s_client)
+    
+    def tearDown(self):
+        for worker in self.agent._workers:
+            worker.shutdown(wait=True)
+        self.agent.aws_resolver._refresh_executor.shutdown(wait=True)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
     
     def test_configmap_to_networkpolicy_conversion(self):
         """Test ConfigMap to NetworkPolicy conversion"""
@@ -204,6 +392,38 @@ class TestEgressAgent(unittest.TestCase):
         egress_rules = network_policy['spec']['egress']
         self.assertEqual(egress_rules[0]['to'][0]['ipBlock']['cidr'], '52.216.0.0/15')
     
+    def test_aws_service_with_multiple_cidrs(self):
+        """Test every resolved CIDR ends up in the egress rule"""
+        self.agent.aws_resolver.resolve_service_cidrs = Mock(
+            return_value=["52.216.0.0/15", "54.231.0.0/17"]
+        )
+        
+        configmap_data = {
+            "policy.json": json.dumps({
+                "defaultAction": "deny",
+                "allowedDestinations": [
+                    {
+                        "name": "s3-access",
+                        "awsService": "s3",
+                        "regions": ["us-east-1"],
+                        "ports": [443]
+                    }
+                ]
+            })
+        }
+        
+        network_policy = self.agent.generate_network_policy(
+            namespace="tenant-a",
+            policy_data=configmap_data
+        )
+        
+        egress_rules = network_policy['spec']['egress']
+        self.assertEqual(len(egress_rules), 1)
+        self.assertEqual(
+            [peer['ipBlock']['cidr'] for peer in egress_rules[0]['to']],
+            ["52.216.0.0/15", "54.231.0.0/17"]
+        )
+    
     def test_invalid_policy_handling(self):
         """Test handling of invalid policy data"""
         configmap_data = {
@@ -216,16 +436,100 @@ class TestEgressAgent(unittest.TestCase):
                 policy_data=configmap_data
             )
     
+    def test_apply_uses_single_server_side_apply_patch(self):
+        """Test NetworkPolicies are applied with one server-side apply request"""
+        self.agent.dry_run = False
+        network_policy = {
+            'metadata': {'name': 'egress-policy-generated', 'namespace': 'tenant-a'},
+            'spec': {'podSelector': {}, 'policyTypes': ['Egress'], 'egress': []}
+        }
+        
+        self.agent.apply_network_policy(network_policy)
+        
+        call_api = self.mock_k8s_client.call_api
+        call_api.assert_called_once()
+        args, kwargs = call_api.call_args
+        self.assertEqual(args[1], 'PATCH')
+        self.assertEqual(kwargs['header_params']['Content-Type'], 'application/apply-patch+yaml')
+        self.assertIn(('fieldManager', 'egress-agent'), kwargs['query_params'])
+        self.assertEqual(kwargs['path_params'], {'namespace': 'tenant-a', 'name': 'egress-policy-generated'})
+        self.assertFalse(kwargs['_preload_content'])
+    
+    def test_unchanged_configmap_is_skipped(self):
+        """Test a MODIFIED event with unchanged data does not re-apply the policy"""
+        self.agent.apply_network_policy = Mock(return_value=True)
+        configmap = {
+            'metadata': {
+                'name': 'egress-policy',
+                'namespace': 'tenant-a',
+                'labels': {'egress-controller': 'managed'}
+            },
+            'data': {
+                'policy.json': json.dumps({"defaultAction": "deny", "allowedDestinations": []})
+            }
+        }
+        
+        self.agent.process_configmap_event('ADDED', configmap)
+        self.agent.process_configmap_event('MODIFIED', configmap)
+        self.assertEqual(self.agent.apply_network_policy.call_count, 1)
+        
+        # Deleting forgets the digest so a re-created ConfigMap is applied again
+        self.agent.process_configmap_event('DELETED', configmap)
+        self.agent.process_configmap_event('ADDED', configmap)
+        self.assertEqual(self.agent.apply_network_policy.call_count, 2)
+        
+        # A new AWS ranges index invalidates the digest of unchanged data
+        self.agent.aws_resolver._set_index({})
+        self.agent.process_configmap_event('MODIFIED', configmap)
+        self.assertEqual(self.agent.apply_network_policy.call_count, 3)
+    
+    def test_dispatch_preserves_namespace_order(self):
+        """Test events for the same namespace are processed in arrival order"""
+        processed = []
+        self.agent.process_configmap_event = lambda event_type, cm: processed.append(event_type)
+        configmap = {'metadata': {'name': 'egress-policy', 'namespace': 'tenant-a'}}
+        
+        futures = [
+            self.agent.dispatch_configmap_event(event_type, configmap)
+            for event_type in ('ADDED', 'MODIFIED', 'DELETED')
+        ]
+        for future in futures:
+            future.result(timeout=5)
+        
+        self.assertEqual(processed, ['ADDED', 'MODIFIED', 'DELETED'])
+    
+    def test_dispatch_logs_failed_events(self):
+        """Test errors escaping a queued event are logged, not dropped"""
+        self.agent.process_configmap_event = Mock(side_effect=KeyError('namespace'))
+        configmap = {'metadata': {'name': 'egress-policy', 'namespace': 'tenant-a'}}
+        
+        with self.assertLogs('egress_agent', level='ERROR') as logs:
+            future = self.agent.dispatch_configmap_event('DELETED', configmap)
+            with self.assertRaises(KeyError):
+                future.result(timeout=5)
+            for worker in self.agent._workers:
+                worker.shutdown(wait=True)
+        
+        self.assertIn("Failed to process ConfigMap event", logs.output[0])
+    
+    def _watch_response(self, events, chunk_size=40):
+        """Fake raw watch response streaming newline-delimited JSON in small chunks"""
+        body = b''.join(json.dumps(event).encode() + b'\n' for event in events)
+        response = Mock()
+        response.stream.return_value = [
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+        ]
+        return response
+    
     def test_watch_configmaps(self):
         """Test ConfigMap watching functionality"""
-        # Mock kubernetes watch
-        mock_watch = Mock()
         mock_event = {
             'type': 'ADDED',
             'object': {
                 'metadata': {
                     'name': 'egress-policy',
                     'namespace': 'tenant-a',
+                    'resourceVersion': '101',
                     'labels': {'egress-controller': 'managed'}
                 },
                 'data': {
@@ -236,15 +540,101 @@ class TestEgressAgent(unittest.TestCase):
                 }
             }
         }
+        bookmark = {'type': 'BOOKMARK', 'object': {'metadata': {'resourceVersion': '105'}}}
         
-        with patch('kubernetes.watch.Watch') as mock_watch_class:
-            mock_watch_class.return_value.stream.return_value = [mock_event]
-            
-            # This would normally run indefinitely, so we'll just test the setup
+        self.agent.dispatch_configmap_event = Mock()
+        self.agent.core_v1.list_config_map_for_all_namespaces = Mock(
+            return_value=self._watch_response([mock_event, bookmark])
+        )
+        
+        with patch.dict(os.environ, {'WATCH_NAMESPACE': ''}):
             self.agent.start_watching()
-            
-            # Verify watch was called
-            mock_watch_class.assert_called_once()
+        
+        # Events are decoded from the raw stream, bookmarks only advance the resourceVersion
+        self.agent.dispatch_configmap_event.assert_called_once_with('ADDED', mock_event['object'])
+        self.assertEqual(self.agent._resource_version, '105')
+        _, kwargs = self.agent.core_v1.list_config_map_for_all_namespaces.call_args
+        self.assertTrue(kwargs['watch'])
+        self.assertFalse(kwargs['_preload_content'])
+        self.assertEqual(kwargs['label_selector'], 'egress-controller=managed')
+    
+    def test_watch_resumes_from_resource_version(self):
+        """Test a reconnect resumes from the last seen resourceVersion"""
+        self.agent._resource_version = '105'
+        self.agent.core_v1.list_config_map_for_all_namespaces = Mock(
+            return_value=self._watch_response([])
+        )
+        
+        with patch.dict(os.environ, {'WATCH_NAMESPACE': ''}):
+            self.agent.start_watching()
+        
+        _, kwargs = self.agent.core_v1.list_config_map_for_all_namespaces.call_args
+        self.assertEqual(kwargs['resource_version'], '105')
+    
+    def test_watch_relists_after_index_update(self):
+        """Test a new AWS ranges index restarts the watch without a resourceVersion"""
+        self.agent._resource_version = '105'
+        self.agent.aws_resolver._set_index({})
+        self.agent.core_v1.list_config_map_for_all_namespaces = Mock(
+            side_effect=lambda **kwargs: self._watch_response([])
+        )
+        
+        with patch.dict(os.environ, {'WATCH_NAMESPACE': ''}):
+            self.agent.start_watching()
+            self.agent._resource_version = '106'
+            self.agent.start_watching()
+        
+        calls = self.agent.core_v1.list_config_map_for_all_namespaces.call_args_list
+        self.assertNotIn('resource_version', calls[0][1])
+        self.assertEqual(calls[1][1]['resource_version'], '106')
+    
+    @patch('egress_agent.time.sleep')
+    def test_run_backs_off_between_failed_watches(self, mock_sleep):
+        """Test failed watches are retried with growing, capped delays"""
+        self.agent.start_watching = Mock(side_effect=[
+            Exception("connection refused"),
+            Exception("connection refused"),
+            None,
+            Exception("connection refused"),
+            KeyboardInterrupt()
+        ])
+        
+        with patch('egress_agent.random.uniform', return_value=1.0):
+            with self.assertRaises(KeyboardInterrupt):
+                self.agent.run()
+        
+        # The successful watch resets the backoff
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays, [1.0, 2.0, 1.0])
+    
+    def test_watch_expired_resource_version(self):
+        """Test a 410 Gone watch error forces a fresh list"""
+        self.agent._resource_version = '1'
+        expired = {'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'message': 'too old'}}
+        response = self._watch_response([expired])
+        self.agent.core_v1.list_config_map_for_all_namespaces = Mock(return_value=response)
+        
+        with patch.dict(os.environ, {'WATCH_NAMESPACE': ''}):
+            self.agent.start_watching()
+        
+        self.assertIsNone(self.agent._resource_version)
+        # The stream was abandoned mid-way, so the connection is closed before release
+        self.assertEqual([c[0] for c in response.method_calls[-2:]], ['close', 'release_conn'])
+    
+    def test_watch_error_event_fails_the_session(self):
+        """Test a non-410 watch error is raised so run() backs off before reconnecting"""
+        self.agent._resource_version = '7'
+        failure = {'type': 'ERROR', 'object': {'kind': 'Status', 'code': 500, 'message': 'etcd unavailable'}}
+        self.agent.core_v1.list_config_map_for_all_namespaces = Mock(
+            return_value=self._watch_response([failure])
+        )
+        
+        with patch.dict(os.environ, {'WATCH_NAMESPACE': ''}):
+            with self.assertRaises(ApiException) as raised:
+                self.agent.start_watching()
+        
+        self.assertEqual(raised.exception.status, 500)
+        self.assertEqual(self.agent._resource_version, '7')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest.mock import Mock, patch
+
+from policy_tester import BLOCKED_TARGETS, EgressPolicyTester
+
+
+def exec_response(stdout: str, still_open: bool = False) -> Mock:
+    """Exec stream stand-in that has finished with the given stdout"""
+    resp = Mock()
+    resp.is_open.return_value = still_open
+    resp.read_stdout.return_value = stdout
+    return resp
+
+
+class TestEgressPolicyTester(unittest.TestCase):
+
+    def setUp(self):
+        with patch('policy_tester.config'):
+            self.tester = EgressPolicyTester()
+        self.tester.core_v1 = Mock()
+        self.tester.networking_v1 = Mock()
+
+    def tearDown(self):
+        self.tester._lookup_pool.shutdown()
+
+    def test_probe_script_batches_every_target(self):
+        """Test that all probes run as background jobs in one exec"""
+        with patch('policy_tester.stream', return_value=exec_response("")) as mock_stream:
+            self.tester.run_probes("tenant-a", "egress-probe", [
+                ("10.1.0.1", 443, 5),
+                ("host; rm -rf /", 80, 3),
+            ])
+
+        mock_stream.assert_called_once()
+        kwargs = mock_stream.call_args.kwargs
+        self.assertFalse(kwargs['stderr'])
+
+        command = kwargs['command']
+        self.assertEqual(command[:2], ["sh", "-c"])
+        lines = command[2].splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("--connect-timeout 5 http://10.1.0.1:443;", lines[0])
+        self.assertTrue(lines[0].endswith('echo "RC 0 $?") &'))
+        self.assertIn("'http://host; rm -rf /:80'", lines[1])
+        self.assertTrue(lines[1].endswith('echo "RC 1 $?") &'))
+        self.assertEqual(lines[2], "wait")
+
+        # The slowest probe bounds the whole exec
+        mock_stream.return_value.run_forever.assert_called_once_with(timeout=10)
+        mock_stream.return_value.close.assert_called_once()
+
+    def test_return_codes_map_to_results(self):
+        """Test that RC lines are matched back to probes by index"""
+        stdout = "noise\nRC 3 7\nRC 0 0\nRC 2 124\nRC 1 28\n"
+        probes = [("a", 80, 5), ("b", 80, 5), ("c", 80, 5), ("d", 80, 5)]
+
+        with patch('policy_tester.stream', return_value=exec_response(stdout)):
+            results = self.tester.run_probes("tenant-a", "egress-probe", probes)
+
+        self.assertEqual([r.test_name for r in results],
+                         ["connect-to-a:80", "connect-to-b:80", "connect-to-c:80", "connect-to-d:80"])
+        self.assertEqual([r.actual for r in results], ["allow", "deny", "deny", "deny"])
+        self.assertEqual(results[1].details, "Connection blocked (timeout)")
+        self.assertEqual(results[2].details, "Connection blocked (timeout)")
+        self.assertEqual(results[3].details, "Connection failed: curl exit code 7")
+
+    def test_missing_rc_line_is_an_error(self):
+        """Test that a probe without an RC line is reported as an error"""
+        with patch('policy_tester.stream', return_value=exec_response("RC 0 0\n")):
+            results = self.tester.run_probes("tenant-a", "egress-probe", [("a", 80, 5), ("b", 80, 5)])
+
+        self.assertEqual(results[0].actual, "allow")
+        self.assertEqual(results[1].actual, "error")
+        self.assertFalse(results[1].success)
+        self.assertEqual(results[1].details, "No result from probe")
+
+    def test_exec_timeout_reported_for_unfinished_probes(self):
+        """Test that probes cut off by the exec timeout say so"""
+        resp = exec_response("RC 0 0\n", still_open=True)
+        with patch('policy_tester.stream', return_value=resp):
+            results = self.tester.run_probes("tenant-a", "egress-probe", [("a", 80, 5), ("b", 80, 5)])
+
+        self.assertEqual(results[0].actual, "allow")
+        self.assertEqual(results[1].actual, "error")
+        self.assertEqual(results[1].details, "Exec timed out")
+        resp.close.assert_called_once()
+
+    def test_exec_failure_fails_every_probe(self):
+        """Test that a failed exec marks each probe with the error"""
+        with patch('policy_tester.stream', side_effect=Exception("pod not found")):
+            results = self.tester.run_probes("tenant-a", "egress-probe", [("a", 80, 5), ("b", 80, 5)])
+
+        self.assertEqual([r.actual for r in results], ["error", "error"])
+        self.assertEqual([r.details for r in results], ["pod not found", "pod not found"])
+
+    def test_destinations_expect_allow_then_deny(self):
+        """Test that allowed destinations expect allow and blocked targets expect deny"""
+        policy = {
+            "allowedDestinations": [
+                {"name": "onprem", "cidr": "10.1.0.0/16", "ports": [443]},
+                {"name": "s3", "awsService": "s3"}
+            ]
+        }
+        # Everything connects, so only the allowed destinations pass
+        stdout = "".join(f"RC {i} 0\n" for i in range(2 + len(BLOCKED_TARGETS)))
+
+        with patch.object(self.tester, 'ensure_probe_pod', return_value="egress-probe"), \
+             patch('policy_tester.stream', return_value=exec_response(stdout)):
+            results = self.tester.test_destinations("tenant-a", policy)
+
+        self.assertEqual(results[0].test_name, "connect-to-10.1.0.1:443")
+        self.assertEqual(results[1].test_name, "connect-to-s3.amazonaws.com:443")
+        self.assertEqual([r.expected for r in results],
+                         ["allow", "allow"] + ["deny"] * len(BLOCKED_TARGETS))
+        self.assertEqual([r.success for r in results],
+                         [True, True] + [False] * len(BLOCKED_TARGETS))
+
+    def test_invalid_destination_does_not_abort_validation(self):
+        """Test that a bad cidr or non-object policy fails only its namespace"""
+        self.tester._namespaces = ["bad-cidr", "not-an-object"]
+        self.tester._namespaces_fetched = float('inf')
+        self.tester._policy_cache = {
+            "bad-cidr": '{"allowedDestinations": [{"name": "bad", "cidr": "bad"}]}',
+            "not-an-object": '["allowedDestinations"]',
+        }
+        # Every blocked target times out, as the policy intends
+        stdout = "".join(f"RC {i} 28\n" for i in range(len(BLOCKED_TARGETS)))
+
+        with patch.object(self.tester, 'check_networkpolicy_exists', return_value=True), \
+             patch.object(self.tester, 'ensure_probe_pod', return_value="egress-probe"), \
+             patch('policy_tester.stream', side_effect=lambda *a, **kw: exec_response(stdout)):
+            results = self.tester.run_full_validation()
+
+        self.assertEqual([v["namespace"] for v in results["namespaces"]], ["bad-cidr", "not-an-object"])
+        for validation in results["namespaces"]:
+            self.assertTrue(validation["networkpolicy_exists"])
+            tests = validation["tests"]
+            self.assertEqual(tests[0].test_name, "allowed-destinations")
+            self.assertFalse(tests[0].success)
+
+            # The blocked targets are still probed
+            self.assertEqual([t.expected for t in tests[1:]], ["deny"] * len(BLOCKED_TARGETS))
+            self.assertTrue(all(t.success for t in tests[1:]))
+            self.assertEqual(validation["summary"]["failed"], 1)
+
+    def test_wait_for_pod_running_uses_watch(self):
+        """Test that a Running event from the watch ends the wait without polling"""
+        pending = Mock(status=Mock(phase="Pending"))
+        running = Mock(status=Mock(phase="Running"))
+
+        with patch('policy_tester.watch.Watch') as mock_watch:
+            mock_watch.return_value.stream.return_value = iter([{'object': pending}, {'object': running}])
+            self.tester._wait_for_pod_running("tenant-a", "egress-probe")
+
+        mock_watch.return_value.stop.assert_called_once()
+        self.assertEqual(mock_watch.return_value.stream.call_args.kwargs['field_selector'],
+                         "metadata.name=egress-probe")
+        self.tester.core_v1.read_namespaced_pod.assert_not_called()
+
+    @patch('policy_tester.time.sleep')
+    def test_wait_for_pod_running_polls_after_watch_closes(self, mock_sleep):
+        """Test that readiness falls back to polling when the watch ends early"""
+        self.tester.core_v1.read_namespaced_pod.side_effect = [
+            Mock(status=Mock(phase="Pending")),
+            Mock(status=Mock(phase="Running")),
+        ]
+
+        with patch('policy_tester.watch.Watch') as mock_watch:
+            mock_watch.return_value.stream.return_value = iter([])
+            self.tester._wait_for_pod_running("tenant-a", "egress-probe")
+
+        self.assertEqual(self.tester.core_v1.read_namespaced_pod.call_count, 2)
+        mock_sleep.assert_called_once()
+
+    def test_wait_for_pod_running_fails_on_finished_pod(self):
+        """Test that a pod that already exited is not waited on"""
+        failed = Mock(status=Mock(phase="Failed"))
+
+        with patch('policy_tester.watch.Watch') as mock_watch:
+            mock_watch.return_value.stream.return_value = iter([{'object': failed}])
+            with self.assertRaises(Exception):
+                self.tester._wait_for_pod_running("tenant-a", "egress-probe")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,265 +1,265 @@
 #!/usr/bin/env python3
 
-import unittest
-import json
-import sys
-import os
-
-# Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
-
-from webhook_server import app, create_admission_response
-
-
-class TestWebhookServer(unittest.TestCase):
-    
-    def setUp(self):
-        """Set up test client"""
-        self.app = app.test_client()
-        self.app.testing = True
-    
-    def test_health_endpoint(self):
-        """Test health check endpoint"""
-        response = self.app.get('/health')
-        self.assertEqual(response.status_code, 200)
-        
-        data = json.loads(response.data)
-        self.assertEqual(data['status'], 'healthy')
-        self.assertEqual(data['service'], 'egress-policy-webhook')
-    
-    def test_readiness_endpoint(self):
-        """Test readiness check endpoint"""
-        response = self.app.get('/ready')
-        self.assertEqual(response.status_code, 200)
-        
-        data = json.loads(response.data)
-        self.assertEqual(data['status'], 'ready')
-    
-    def test_valid_egress_policy_configmap(self):
-        """Test validation of valid egress policy ConfigMap"""
-        admission_request = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "request": {
-                "uid": "test-uid-123",
-                "operation": "CREATE",
-                "object": {
-                    "metadata": {
-                        "name": "egress-policy",
-                        "namespace": "tenant-a",
-                        "labels": {
-                            "egress-controller": "managed"
-                        }
-                    },
-                    "data": {
-                        "policy.json": json.dumps({
-                            "defaultAction": "deny",
-                            "allowedDestinations": [
-                                {
-                                    "name": "s3-access",
-                                    "awsService": "s3",
-                                    "regions": ["us-east-1"],
-                                    "ports": [443]
-                                }
-                            ]
-                        })
-                    }
-                }
-            }
-        }
-        
-        response = self.app.post('/validate',
-                                data=json.dumps(admission_request),
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 200)
-        
-        data = json.loads(response.data)
-        self.assertTrue(data['response']['allowed'])
-        self.assertEqual(data['response']['uid'], 'test-uid-123')
-    
-    def test_invalid_json_in_policy(self):
-        """Test validation with invalid JSON in policy"""
-        admission_request = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "request": {
-                "uid": "test-uid-456",
-                "operation": "CREATE",
-                "object": {
-                    "metadata": {
-                        "name": "bad-policy",
-                        "namespace": "tenant-a",
-                        "labels": {
-                            "egress-controller": "managed"
-                        }
-                    },
-                    "data": {
-                        "policy.json": "invalid-json-here"
-                    }
-                }
-            }
-        }
-        
-        response = self.app.post('/validate',
-                                data=json.dumps(admission_request),
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 400)
-        
-        data = json.loads(response.data)
-        self.assertFalse(data['response']['allowed'])
-        self.assertIn("Invalid JSON", data['response']['status']['message'])
-    
-    def test_invalid_policy_structure(self):
-        """Test validation with invalid policy structure"""
-        admission_request = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "request": {
-                "uid": "test-uid-789",
-                "operation": "UPDATE",
-                "object": {
-                    "metadata": {
-                        "name": "invalid-policy",
-                        "namespace": "tenant-b",
-                        "labels": {
-                            "egress-controller": "managed"
-                        }
-                    },
-                    "data": {
-                        "policy.json": json.dumps({
-                            "defaultAction": "invalid-action",
-                            "allowedDestinations": [
-                                {
-                                    "name": "bad-dest",
-                                    "cidr": "invalid-cidr",
-                                    "ports": [443]
-                                }
-                            ]
-                        })
-                    }
-                }
-            }
+from unittest.mock import patch
+
+import orjson
+import pytest
+
+import webhook_server
+from webhook_server import app, create_admission_response, encode_admission_response
+
+
+_ADMIT_BASE = {"apiVersion": "admission.k8s.io/v1", "kind": "AdmissionReview"}
+MANAGED_LABELS = {"egress-controller": "managed"}
+
+VALID_POLICY_JSON = orjson.dumps({
+    "defaultAction": "deny",
+    "allowedDestinations": [
+        {
+            "name": "s3-access",
+            "awsService": "s3",
+            "regions": ["us-east-1"],
+            "ports": [443]
         }
-        
-        response = self.app.post('/validate',
-                                data=json.dumps(admission_request),
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 400)
-        
-        data = json.loads(response.data)
-        self.assertFalse(data['response']['allowed'])
-        self.assertIn("Policy validation failed", data['response']['status']['message'])
-    
-    def test_non_managed_configmap_allowed(self):
-        """Test that non-managed ConfigMaps are allowed through"""
-        admission_request = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "request": {
-                "uid": "test-uid-000",
-                "operation": "CREATE",
-                "object": {
-                    "metadata": {
-                        "name": "regular-configmap",
-                        "namespace": "default",
-                        "labels": {
-                            "app": "some-app"
-                        }
-                    },
-                    "data": {
-                        "config.yaml": "some: config"
-                    }
-                }
-            }
+    ]
+}).decode()
+
+INVALID_POLICY_JSON = orjson.dumps({
+    "defaultAction": "invalid-action",
+    "allowedDestinations": [
+        {
+            "name": "bad-dest",
+            "cidr": "invalid-cidr",
+            "ports": [443]
         }
-        
-        response = self.app.post('/validate',
-                                data=json.dumps(admission_request),
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 200)
-        
-        data = json.loads(response.data)
-        self.assertTrue(data['response']['allowed'])
-        self.assertIn("Not an egress policy ConfigMap", data['response']['status']['message'])
-    
-    def test_missing_policy_json(self):
-        """Test validation with missing policy.json"""
-        admission_request = {
-            "apiVersion": "admission.k8s.io/v1",
-            "kind": "AdmissionReview",
-            "request": {
-                "uid": "test-uid-missing",
-                "operation": "CREATE",
-                "object": {
-                    "metadata": {
-                        "name": "empty-policy",
-                        "namespace": "tenant-c",
-                        "labels": {
-                            "egress-controller": "managed"
-                        }
-                    },
-                    "data": {
-                        "other-data": "not-policy"
-                    }
-                }
+    ]
+}).decode()
+
+REPEAT_POLICY_JSON = orjson.dumps({
+    "defaultAction": "deny",
+    "allowedDestinations": [
+        {"name": "repeat", "cidr": "10.9.0.0/16", "ports": [8443]}
+    ]
+}).decode()
+
+
+@pytest.fixture(scope='module')
+def client():
+    """Flask test client shared by the module"""
+    app.testing = True
+    return app.test_client()
+
+
+def configmap_review(uid, operation, name, namespace, labels, data):
+    """Build an AdmissionReview for a ConfigMap"""
+    return {
+        **_ADMIT_BASE,
+        "request": {
+            "uid": uid,
+            "operation": operation,
+            "object": {
+                "metadata": {
+                    "name": name,
+                    "namespace": namespace,
+                    "labels": labels
+                },
+                "data": data
             }
         }
-        
-        response = self.app.post('/validate',
-                                data=json.dumps(admission_request),
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 400)
-        
-        data = json.loads(response.data)
-        self.assertFalse(data['response']['allowed'])
-        self.assertIn("Missing policy.json", data['response']['status']['message'])
-    
-    def test_empty_admission_request(self):
-        """Test handling of empty admission request"""
-        response = self.app.post('/validate',
-                                data='',
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 400)
-    
-    def test_malformed_admission_request(self):
-        """Test handling of malformed admission request"""
-        response = self.app.post('/validate',
-                                data='invalid-json',
-                                content_type='application/json')
-        
-        self.assertEqual(response.status_code, 400)
-
-
-class TestAdmissionResponse(unittest.TestCase):
-    
-    def test_create_allowed_response(self):
-        """Test creating allowed admission response"""
-        response = create_admission_response(True, "All good", "test-uid")
-        
-        self.assertEqual(response['apiVersion'], 'admission.k8s.io/v1')
-        self.assertEqual(response['kind'], 'AdmissionReview')
-        self.assertTrue(response['response']['allowed'])
-        self.assertEqual(response['response']['uid'], 'test-uid')
-        self.assertEqual(response['response']['status']['code'], 200)
-        self.assertEqual(response['response']['status']['message'], 'All good')
-    
-    def test_create_denied_response(self):
-        """Test creating denied admission response"""
-        response = create_admission_response(False, "Validation failed", "test-uid")
-        
-        self.assertEqual(response['apiVersion'], 'admission.k8s.io/v1')
-        self.assertEqual(response['kind'], 'AdmissionReview')
-        self.assertFalse(response['response']['allowed'])
-        self.assertEqual(response['response']['uid'], 'test-uid')
-        self.assertEqual(response['response']['status']['code'], 400)
-        self.assertEqual(response['response']['status']['message'], 'Validation failed')
-
-
-if __name__ == '__main__':
-    unittest.main()
+    }
+
+
+def post_review(client, admission_request):
+    """POST an AdmissionReview to /validate"""
+    return client.post('/validate',
+                       data=orjson.dumps(admission_request),
+                       content_type='application/json')
+
+
+def test_health_endpoint(client):
+    """Test health check endpoint"""
+    response = client.get('/health')
+    assert response.status_code == 200
+
+    data = orjson.loads(response.data)
+    assert data['status'] == 'healthy'
+    assert data['service'] == 'egress-policy-webhook'
+
+
+def test_readiness_endpoint(client):
+    """Test readiness check endpoint"""
+    response = client.get('/ready')
+    assert response.status_code == 200
+
+    data = orjson.loads(response.data)
+    assert data['status'] == 'ready'
+
+
+def test_valid_egress_policy_configmap(client):
+    """Test validation of valid egress policy ConfigMap"""
+    admission_request = configmap_review(
+        "test-uid-123", "CREATE", "egress-policy", "tenant-a",
+        MANAGED_LABELS, {"policy.json": VALID_POLICY_JSON}
+    )
+
+    response = post_review(client, admission_request)
+
+    assert response.status_code == 200
+
+    data = orjson.loads(response.data)
+    assert data['response']['allowed']
+    assert data['response']['uid'] == 'test-uid-123'
+
+
+@pytest.mark.parametrize("name, data, message", [
+    pytest.param("bad-policy", {"policy.json": "invalid-json-here"}, "Invalid JSON",
+                 id="invalid-json-in-policy"),
+    pytest.param("invalid-policy", {"policy.json": INVALID_POLICY_JSON},
+                 "Policy validation failed", id="invalid-policy-structure"),
+    pytest.param("empty-policy", {"other-data": "not-policy"}, "Missing policy.json",
+                 id="missing-policy-json"),
+])
+def test_rejected_policy_configmap(client, name, data, message):
+    """Test that bad egress policy ConfigMaps are denied with a reason"""
+    admission_request = configmap_review(
+        "test-uid-456", "CREATE", name, "tenant-a", MANAGED_LABELS, data
+    )
+
+    response = post_review(client, admission_request)
+
+    assert response.status_code == 400
+
+    data = orjson.loads(response.data)
+    assert not data['response']['allowed']
+    assert message in data['response']['status']['message']
+
+
+@pytest.mark.parametrize("policy_json, message", [
+    pytest.param('["not", "an", "object"]', "policy.json must be a JSON object", id="policy-not-object"),
+    pytest.param('{"allowedDestinations": [5]}', "Destination 0: must be an object",
+                 id="destination-not-object"),
+    pytest.param('{"allowedDestinations": [{"name": "s3", "awsService": 5, "regions": ["us-east-1"], '
+                 '"ports": [443]}]}', "Destination 0: awsService must be a string",
+                 id="aws-service-not-string"),
+    pytest.param('{"defaultAction": [], "allowedDestinations": []}', "Invalid defaultAction",
+                 id="default-action-not-string"),
+    pytest.param('{"allowedDestinations": [{"name": "s3", "awsService": "s3", "regions": [["x"]], '
+                 '"ports": [443]}]}', "Destination 0: regions must be a list of strings",
+                 id="region-not-string"),
+])
+def test_malformed_policy_fields(client, policy_json, message):
+    """Test that wrongly-typed policy fields are rejected, not errored"""
+    admission_request = configmap_review(
+        "test-uid-321", "CREATE", "egress-policy", "tenant-a", MANAGED_LABELS,
+        {"policy.json": policy_json}
+    )
+
+    response = post_review(client, admission_request)
+
+    assert response.status_code == 400
+    data = orjson.loads(response.data)
+    assert not data['response']['allowed']
+    assert message in data['response']['status']['message']
+
+
+def test_repeated_valid_policy_skips_revalidation(client):
+    """Test that a policy already seen valid is not validated again"""
+    admission_request = configmap_review(
+        "test-uid-789", "UPDATE", "egress-policy", "tenant-c",
+        MANAGED_LABELS, {"policy.json": REPEAT_POLICY_JSON}
+    )
+
+    with patch.object(webhook_server.validator, 'validate',
+                      wraps=webhook_server.validator.validate) as validate:
+        for _ in range(2):
+            response = post_review(client, admission_request)
+            assert response.status_code == 200
+            assert orjson.loads(response.data)['response']['allowed']
+
+    assert validate.call_count == 1
+
+
+def test_non_managed_configmap_allowed(client):
+    """Test that non-managed ConfigMaps are allowed through"""
+    admission_request = configmap_review(
+        "test-uid-000", "CREATE", "regular-configmap", "default",
+        {"app": "some-app"}, {"config.yaml": "some: config"}
+    )
+
+    response = post_review(client, admission_request)
+
+    assert response.status_code == 200
+
+    data = orjson.loads(response.data)
+    assert data['response']['allowed']
+    assert "Not an egress policy ConfigMap" in data['response']['status']['message']
+
+
+@pytest.mark.parametrize("body", [
+    pytest.param('', id="empty"),
+    pytest.param('invalid-json', id="malformed"),
+])
+def test_unparsable_admission_request(client, body):
+    """Test handling of empty or malformed admission request bodies"""
+    response = client.post('/validate', data=body, content_type='application/json')
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("admission_request", [
+    [1, 2],
+    {"request": "not-an-object"},
+    {"request": {"object": {"metadata": {"labels": ["egress-controller"]}}}},
+    {"request": {"object": {"metadata": {"labels": {"egress-controller": "managed"}},
+                            "data": {"policy.json": {"defaultAction": "deny"}}}}},
+])
+def test_malformed_admission_review_shape(client, admission_request):
+    """Test that wrongly-typed AdmissionReview fields are rejected, not errored"""
+    response = post_review(client, admission_request)
+
+    assert response.status_code == 400
+    data = orjson.loads(response.data)
+    assert not data['response']['allowed']
+    assert "Malformed AdmissionReview" in data['response']['status']['message']
+
+
+@pytest.mark.parametrize("path", ['/validate/', '/validate/anything'])
+def test_paths_below_validate_not_found(client, path):
+    """Test that only /validate itself reaches the admission handler"""
+    response = client.post(path, data=orjson.dumps(_ADMIT_BASE), content_type='application/json')
+
+    assert response.status_code == 404
+
+
+def test_create_allowed_response():
+    """Test creating allowed admission response"""
+    response = create_admission_response(True, "All good", "test-uid")
+
+    assert response['apiVersion'] == 'admission.k8s.io/v1'
+    assert response['kind'] == 'AdmissionReview'
+    assert response['response']['allowed']
+    assert response['response']['uid'] == 'test-uid'
+    assert response['response']['status']['code'] == 200
+    assert response['response']['status']['message'] == 'All good'
+
+
+def test_create_denied_response():
+    """Test creating denied admission response"""
+    response = create_admission_response(False, "Validation failed", "test-uid")
+
+    assert response['apiVersion'] == 'admission.k8s.io/v1'
+    assert response['kind'] == 'AdmissionReview'
+    assert not response['response']['allowed']
+    assert response['response']['uid'] == 'test-uid'
+    assert response['response']['status']['code'] == 400
+    assert response['response']['status']['message'] == 'Validation failed'
+
+
+@pytest.mark.parametrize("allowed, message, uid", [
+    (True, "All good", "uid-1"),
+    (False, 'bad "quote"\n  \\', "uid-\"2"),
+])
+def test_encoded_response_matches_dict(allowed, message, uid):
+    """Test the pre-serialized response encodes the same review"""
+    assert orjson.loads(encode_admission_response(allowed, message, uid)) == \
+        create_admission_response(allowed, message, uid)
@@ -1,18 +1,69 @@
 #!/usr/bin/env python3
-import json
 import os
 import time
 import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from kubernetes import client, config
-from datetime import datetime
-from typing import List, Dict, Tuple
+from dataclasses import dataclass
+from typing import ClassVar, FrozenSet, Iterator, List, Dict, Optional, Tuple
+
+POD_PAGE_SIZE = 500
+CONSTRAINT_TYPES_TTL = 3600  # 1 hour
+
+# resourceVersion "0" lets the API server answer from its watch cache instead of
+# a quorum read from etcd; an audit tolerates that cache being a moment behind
+CACHED_READ = "0"
+
+# Findings are fixed-shape records, kept as slotted dataclasses rather than dicts
+@dataclass(frozen=True, slots=True)
+class DriftIssue:
+    type: str
+    app: str
+    sync_status: str
+    health_status: str
+
+@dataclass(frozen=True, slots=True)
+class GatekeeperViolation:
+    constraint: str
+    type: str
+    resource: str
+    namespace: str
+    message: str
+
+@dataclass(frozen=True, slots=True)
+class SecurityCheck:
+    severity: str
+    type: str
+    resource: str
+    namespace: str
+    container: Optional[str] = None
+
+@dataclass(frozen=True, slots=True)
+class NetworkIssue:
+    severity: str
+    type: str
+    namespace: str
+    message: str
 
 class EKSSecurityHealthAgent:
+    # Namespaces whose pods are not audited
+    _SKIP_NS: ClassVar[FrozenSet[str]] = frozenset({'kube-system', 'kube-public', 'argocd', 'gatekeeper-system'})
+    # Namespaces not expected to carry their own NetworkPolicies
+    _SYSTEM_NS: ClassVar[FrozenSet[str]] = frozenset({'kube-system', 'kube-public', 'kube-node-lease'})
+    # Server-side form of the pod skip-list, built once
+    _POD_FIELD_SELECTOR: ClassVar[str] = ','.join(
+        [f"metadata.namespace!={ns}" for ns in sorted(_SKIP_NS)] + ['status.phase!=Succeeded']
+    )
+
     def __init__(self):
         self.security_violations = []
         self.drift_issues = []
         self.policy_status = {}
         self.argocd_apps = []
+        self._constraint_types = None
+        self._constraint_types_fetched = 0.0
         self._init_k8s_client()
 
     def _init_k8s_client(self):
@@ -29,14 +80,15 @@ class EKSSecurityHealthAgent:
         self.networking_v1 = client.NetworkingV1Api()
         self.custom_api = client.CustomObjectsApi()
 
-    def check_argocd_sync_status(self) -> List[Dict]:
+    def check_argocd_sync_status(self) -> List[DriftIssue]:
         """Check ArgoCD application sync status for drift detection"""
         try:
             apps = self.custom_api.list_namespaced_custom_object(
                 group="argoproj.io",
                 version="v1alpha1",
                 namespace="argocd",
-                plural="applications"
+                plural="applications",
+                resource_version=CACHED_READ
             )
             
             self.argocd_apps = apps.get('items', [])
@@ -47,97 +99,130 @@ class EKSSecurityHealthAgent:
                 health_status = status.get('health', {}).get('status', 'Unknown')
                 
                 if sync_status != 'Synced' or health_status != 'Healthy':
-                    self.drift_issues.append({
-                        'type': 'ArgoCD Drift',
-                        'app': app['metadata']['name'],
-                        'sync_status': sync_status,
-                        'health_status': health_status
-                    })
+                    self.drift_issues.append(DriftIssue(
+                        type='ArgoCD Drift',
+                        app=app['metadata']['name'],
+                        sync_status=sync_status,
+                        health_status=health_status
+                    ))
             
             return self.drift_issues
         except client.ApiException as e:
             print(f"⚠️  ArgoCD not found or not accessible: {e.status}")
             return []
 
-    def validate_gatekeeper_constraints(self) -> List[Dict]:
-        """Validate existing Gatekeeper constraints and their violations"""
+    def _get_constraint_types(self) -> List[str]:
+        """List Gatekeeper constraint kinds, reusing the result for an hour"""
+        if (self._constraint_types is not None and
+                time.time() - self._constraint_types_fetched < CONSTRAINT_TYPES_TTL):
+            return self._constraint_types
+        
+        # Get constraint templates
+        templates = self.custom_api.list_cluster_custom_object(
+            group="templates.gatekeeper.sh",
+            version="v1beta1",
+            plural="constrainttemplates",
+            resource_version=CACHED_READ
+        )
+        
+        constraint_types = []
+        for template in templates.get('items', []):
+            crd = template.get('spec', {}).get('crd', {})
+            names = crd.get('spec', {}).get('names', {})
+            if names.get('kind'):
+                constraint_types.append(names['kind'].lower())
+        
+        self._constraint_types = constraint_types
+        self._constraint_types_fetched = time.time()
+        return constraint_types
+
+    def _list_constraints(self, ctype: str) -> List[Dict]:
+        """List the constraints of one kind, or nothing if the kind is unavailable"""
         try:
-            # Get constraint templates
-            templates = self.custom_api.list_cluster_custom_object(
-                group="templates.gatekeeper.sh",
+            constraints = self.custom_api.list_cluster_custom_object(
+                group="constraints.gatekeeper.sh",
                 version="v1beta1",
-                plural="constrainttemplates"
+                plural=ctype,
+                resource_version=CACHED_READ
             )
-            
-            constraint_types = []
-            for template in templates.get('items', []):
-                crd = template.get('spec', {}).get('crd', {})
-                names = crd.get('spec', {}).get('names', {})
-                if names.get('kind'):
-                    constraint_types.append(names['kind'].lower())
+            return constraints.get('items', [])
+        except client.ApiException:
+            return []
+
+    def validate_gatekeeper_constraints(self) -> List[GatekeeperViolation]:
+        """Validate existing Gatekeeper constraints and their violations"""
+        try:
+            constraint_types = self._get_constraint_types()
             
             print(f"🔍 Found {len(constraint_types)} constraint types")
             
+            # One list per constraint kind, issued concurrently
+            with ThreadPoolExecutor(max_workers=max(1, min(8, len(constraint_types)))) as executor:
+                constraints_by_type = list(executor.map(self._list_constraints, constraint_types))
+            
             # Check each constraint type for violations
-            for ctype in constraint_types:
-                try:
-                    constraints = self.custom_api.list_cluster_custom_object(
-                        group="constraints.gatekeeper.sh",
-                        version="v1beta1",
-                        plural=ctype
-                    )
+            violations_found = []
+            for ctype, constraints in zip(constraint_types, constraints_by_type):
+                for constraint in constraints:
+                    name = constraint['metadata']['name']
+                    violations = constraint.get('status', {}).get('violations', [])
                     
-                    for constraint in constraints.get('items', []):
-                        name = constraint['metadata']['name']
-                        violations = constraint.get('status', {}).get('violations', [])
-                        
-                        self.policy_status[name] = {
-                            'type': ctype,
-                            'violations': len(violations),
-                            'enforcement_action': constraint.get('spec', {}).get('enforcementAction', 'warn')
-                        }
-                        
-                        for violation in violations:
-                            self.security_violations.append({
-                                'constraint': name,
-                                'type': ctype,
-                                'resource': violation.get('name', 'Unknown'),
-                                'namespace': violation.get('namespace', 'Unknown'),
-                                'message': violation.get('message', 'No message')
-                            })
-                except client.ApiException:
-                    continue
+                    self.policy_status[name] = {
+                        'type': ctype,
+                        'violations': len(violations),
+                        'enforcement_action': constraint.get('spec', {}).get('enforcementAction', 'warn')
+                    }
+                    
+                    for violation in violations:
+                        violations_found.append(GatekeeperViolation(
+                            constraint=name,
+                            type=ctype,
+                            resource=violation.get('name', 'Unknown'),
+                            namespace=violation.get('namespace', 'Unknown'),
+                            message=violation.get('message', 'No message')
+                        ))
+            
+            self.security_violations.extend(violations_found)
                     
         except client.ApiException as e:
             print(f"❌ Failed to validate Gatekeeper constraints: {e.status}")
         
         return self.security_violations
 
-    def check_critical_security_policies(self) -> List[Dict]:
+    def _list_audited_pods(self) -> Iterator[client.V1Pod]:
+        """Yield non-system, non-completed pods a page at a time"""
+        _continue = None
+        while True:
+            pods = self.v1.list_pod_for_all_namespaces(
+                field_selector=self._POD_FIELD_SELECTOR,
+                limit=POD_PAGE_SIZE,
+                _continue=_continue
+            )
+            yield from pods.items
+            _continue = pods.metadata._continue
+            if not _continue:
+                return
+
+    def check_critical_security_policies(self) -> List[SecurityCheck]:
         """Check for critical security policy violations"""
         critical_checks = []
         
         try:
-            pods = self.v1.list_pod_for_all_namespaces()
-            
-            for pod in pods.items:
+            # System namespaces are skipped by the API server's field selector
+            for pod in self._list_audited_pods():
                 namespace = pod.metadata.namespace
                 name = pod.metadata.name
                 
-                # Skip system namespaces
-                if namespace in ['kube-system', 'kube-public', 'argocd', 'gatekeeper-system']:
-                    continue
-                
                 spec = pod.spec
                 
                 # Check pod security context
                 if not spec.security_context:
-                    critical_checks.append({
-                        'severity': 'HIGH',
-                        'type': 'Missing Pod Security Context',
-                        'resource': f"Pod/{name}",
-                        'namespace': namespace
-                    })
+                    critical_checks.append(SecurityCheck(
+                        severity='HIGH',
+                        type='Missing Pod Security Context',
+                        resource=f"Pod/{name}",
+                        namespace=namespace
+                    ))
                 
                 # Check containers
                 for container in spec.containers:
@@ -145,60 +230,64 @@ class EKSSecurityHealthAgent:
                     
                     # Check resource limits
                     if not (container.resources and container.resources.limits):
-                        critical_checks.append({
-                            'severity': 'MEDIUM',
-                            'type': 'Missing Resource Limits',
-                            'resource': f"Pod/{name}",
-                            'namespace': namespace,
-                            'container': container_name
-                        })
+                        critical_checks.append(SecurityCheck(
+                            severity='MEDIUM',
+                            type='Missing Resource Limits',
+                            resource=f"Pod/{name}",
+                            namespace=namespace,
+                            container=container_name
+                        ))
                     
                     # Check security context
                     if container.security_context:
                         # Check for privileged containers
                         if container.security_context.privileged:
-                            critical_checks.append({
-                                'severity': 'CRITICAL',
-                                'type': 'Privileged Container',
-                                'resource': f"Pod/{name}",
-                                'namespace': namespace,
-                                'container': container_name
-                            })
+                            critical_checks.append(SecurityCheck(
+                                severity='CRITICAL',
+                                type='Privileged Container',
+                                resource=f"Pod/{name}",
+                                namespace=namespace,
+                                container=container_name
+                            ))
                         
                         # Check for root user
                         if container.security_context.run_as_user == 0:
-                            critical_checks.append({
-                                'severity': 'HIGH',
-                                'type': 'Container Running as Root',
-                                'resource': f"Pod/{name}",
-                                'namespace': namespace,
-                                'container': container_name
-                            })
+                            critical_checks.append(SecurityCheck(
+                                severity='HIGH',
+                                type='Container Running as Root',
+                                resource=f"Pod/{name}",
+                                namespace=namespace,
+                                container=container_name
+                            ))
         
         except client.ApiException as e:
             print(f"❌ Failed to check critical security policies: {e.status}")
         
         return critical_checks
 
-    def check_network_policies(self) -> List[Dict]:
+    def check_network_policies(self) -> List[NetworkIssue]:
         """Check for missing network policies"""
         network_issues = []
         
         try:
-            namespaces = self.v1.list_namespace()
-            netpols = self.networking_v1.list_network_policy_for_all_namespaces()
-            netpol_namespaces = {np.metadata.namespace for np in netpols.items}
+            # The two lists are independent, so fetch them concurrently
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                namespaces = executor.submit(self.v1.list_namespace, resource_version=CACHED_READ)
+                netpols = executor.submit(
+                    self.networking_v1.list_network_policy_for_all_namespaces, resource_version=CACHED_READ
+                )
+                namespaces, netpols = namespaces.result(), netpols.result()
             
-            for ns in namespaces.items:
-                ns_name = ns.metadata.name
-                if (ns_name not in ['kube-system', 'kube-public', 'kube-node-lease'] and 
-                    ns_name not in netpol_namespaces):
-                    network_issues.append({
-                        'severity': 'MEDIUM',
-                        'type': 'Missing Network Policy',
-                        'namespace': ns_name,
-                        'message': 'Namespace has no network policies defined'
-                    })
+            covered = self._SYSTEM_NS | {np.metadata.namespace for np in netpols.items}
+            network_issues = [
+                NetworkIssue(
+                    severity='MEDIUM',
+                    type='Missing Network Policy',
+                    namespace=ns.metadata.name,
+                    message='Namespace has no network policies defined'
+                )
+                for ns in namespaces.items if ns.metadata.name not in covered
+            ]
         
         except client.ApiException as e:
             print(f"⚠️  Failed to check network policies: {e.status}")
@@ -213,21 +302,28 @@ class EKSSecurityHealthAgent:
         base_score -= medium * 5
         return max(0, base_score)
 
-    def generate_security_report(self) -> Tuple[str, Dict]:
+    def generate_security_report(self, critical_checks: Optional[List[SecurityCheck]] = None,
+                                 network_issues: Optional[List[NetworkIssue]] = None) -> Tuple[str, Dict]:
         """Generate comprehensive security health report"""
-        critical_checks = self.check_critical_security_policies()
-        network_issues = self.check_network_policies()
+        if critical_checks is None:
+            critical_checks = self.check_critical_security_policies()
+        if network_issues is None:
+            network_issues = self.check_network_policies()
         
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
         report_file = f"/tmp/security-health-{timestamp}.json"
         
-        critical_count = len([v for v in critical_checks if v.get('severity') == 'CRITICAL'])
-        high_count = len([v for v in critical_checks if v.get('severity') == 'HIGH'])
-        medium_count = len([v for v in critical_checks if v.get('severity') == 'MEDIUM']) + len(network_issues)
+        severities = Counter(v.severity for v in critical_checks)
+        critical_count = severities['CRITICAL']
+        high_count = severities['HIGH']
+        medium_count = severities['MEDIUM'] + len(network_issues)
+        
+        # Same arithmetic as calculate_health_score, inlined on the report path
+        health_score = max(0, 100 - critical_count * 20 - high_count * 10 - medium_count * 5)
         
         report = {
             'timestamp': timestamp,
-            'security_health_score': self.calculate_health_score(critical_count, high_count, medium_count),
+            'security_health_score': health_score,
             'summary': {
                 'gatekeeper_violations': len(self.security_violations),
                 'drift_issues': len(self.drift_issues),
@@ -244,8 +340,9 @@ class EKSSecurityHealthAgent:
             'policy_status': self.policy_status
         }
         
-        with open(report_file, 'w') as f:
-            json.dump(report, f, indent=2)
+        # orjson serializes the finding dataclasses natively and writes one bytes blob
+        with open(report_file, 'wb') as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
         
         return report_file, report
 
@@ -287,14 +384,22 @@ class EKSSecurityHealthAgent:
         self.policy_status = {}
         self.argocd_apps = []
         
+        # The checks are independent API reads and each fills its own attributes,
+        # so they run concurrently and the audit takes as long as the slowest one
         print("📱 Checking ArgoCD sync status...")
-        self.check_argocd_sync_status()
-        
         print("🔒 Validating Gatekeeper constraints...")
-        self.validate_gatekeeper_constraints()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            argocd = executor.submit(self.check_argocd_sync_status)
+            gatekeeper = executor.submit(self.validate_gatekeeper_constraints)
+            critical = executor.submit(self.check_critical_security_policies)
+            network = executor.submit(self.check_network_policies)
+            argocd.result()
+            gatekeeper.result()
+            critical_checks = critical.result()
+            network_issues = network.result()
         
         print("📊 Generating security report...")
-        report_file, report = self.generate_security_report()
+        report_file, report = self.generate_security_report(critical_checks, network_issues)
         
         self.print_security_summary(report)
         print(f"📄 Report saved: {report_file}")
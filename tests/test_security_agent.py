@@ -31,5 +31,26 @@ class TestEKSSecurityHealthAgent(unittest.TestCase):
         score = self.agent.calculate_health_score(10, 10, 10)
         self.assertEqual(score, 0)
 
+    def test_critical_checks_page_through_filtered_pods(self):
+        """Test pods are listed in pages with system namespaces filtered server-side"""
+        def page(name, token):
+            pod = MagicMock()
+            pod.metadata.namespace = 'app'
+            pod.metadata.name = name
+            pod.spec.containers = []
+            pod.spec.security_context = None
+            return MagicMock(items=[pod], metadata=MagicMock(_continue=token))
+
+        self.agent.v1 = MagicMock()
+        self.agent.v1.list_pod_for_all_namespaces.side_effect = [page('a', 'next'), page('b', None)]
+
+        checks = self.agent.check_critical_security_policies()
+
+        self.assertEqual([c.resource for c in checks], ['Pod/a', 'Pod/b'])
+        calls = self.agent.v1.list_pod_for_all_namespaces.call_args_list
+        self.assertEqual([c.kwargs['_continue'] for c in calls], [None, 'next'])
+        self.assertIn('metadata.namespace!=kube-system', calls[0].kwargs['field_selector'])
+
+
 if __name__ == '__main__':
     unittest.main()